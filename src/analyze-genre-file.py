@@ -15,6 +15,7 @@ from matplotlib import pyplot as plt
 import matplotlib.patches as mpatches
 import math
 from w8m8 import progressbar
+from corpus import open_corpus
 import argparse
 
 alpha = 0.6
@@ -31,6 +32,8 @@ def parse_args():
     parser.add_argument('file', default='billboard.json', help='File to analyze')
     parser.add_argument('--type', default='words', choices=['chars', 'words', 'unique'], help='Type to analyze')
     parser.add_argument('--genres', nargs='*', default='all', help='Genres to consider')
+    parser.add_argument('--folder_name', type=str, default='lyrics', help='Name of folder to look for songs')
+    parser.add_argument('--corpus', type=str, default='', help='Packed corpus file (from "corpus.py"), used instead of the folder')
 
     return parser.parse_args()
 
@@ -39,14 +42,14 @@ def read_data(args):
     analyzer = {genre: {'chars': [], 'words': [], 'unique': []} for genre in args.genres}
 
     cntr = 0
+    lyrics_source = open_corpus(args.corpus, args.folder_name)
     # Analyze length of song/number of unique words
     for idx, (artist, song, genre) in data.items():
         progressbar((int(idx)+1)/len(data))
         if not genre in args.genres:
             continue
-        file_path = os.path.join('lyrics', '{}~{}'.format(artist.replace('/', ''), song.replace('/', '')))
-        if os.path.exists(file_path):
-            lyrics = open(file_path).read()
+        lyrics = lyrics_source.get(artist, song)
+        if lyrics is not None:
             tokenized_lyrics = nltk.wordpunct_tokenize(lyrics)
 
             analyzer[genre]['chars'].append(len(lyrics))
@@ -4,14 +4,35 @@ Uses the nltk NaiveBayesClassifier.
 Takes list of songs with their genre, list of all genres and som settings arguments
 '''
 import nltk
-from nltk import NaiveBayesClassifier, word_tokenize
+from nltk import NaiveBayesClassifier
 from nltk.metrics.scores import precision, recall, f_measure
-from nltk.stem.snowball import SnowballStemmer
-from collections import Counter, defaultdict
+from collections import Counter, defaultdict, deque
 from w8m8 import progressbar
-import operator
+from features import FeatureSpace, SparseSet, lyrics_grams, lyrics_sizes, meta_counts
+from naive_bayes import NaiveBayes
+import numpy as np
+from ngrams import NgramCounter, orders, song_grams, song_lines
+from vocabulary import Vocabulary
+import profiling
+from token_cache import TokenCache, tokenize
+from stemming import get_stemmer
+from multiprocessing import Pool
+from functools import partial
+from copy import copy
+from itertools import islice
+from corpus import in_train_set
 import string
 
+# The classifier in a worker process, set by '_init_worker'
+_worker = None
+
+def _init_worker(classy):
+    global _worker
+    _worker = classy
+
+def _call_worker(method, song):
+    return getattr(_worker, method)(song)
+
 class Classy(NaiveBayesClassifier):
     def __init__(self, corpus, args):
         '''
@@ -45,13 +66,20 @@ class Classy(NaiveBayesClassifier):
         self.num_features_four = args.tri_thresh
         self.num_features_five = args.tri_thresh
 
+        # If set, n-grams of order 2 and up are hashed to 2**hash_bits buckets instead of stored as strings
+        self.hash_bits = args.hash_bits
+
         # Percent to be train, rest is test
         self.percent = args.split / 100
 
         # Extract stopwords
-        self.stopwords = nltk.corpus.stopwords.words('english') + list(string.punctuation) if self.feat_stopwords else set()
+        self.stopwords = set(nltk.corpus.stopwords.words('english') + list(string.punctuation)) if self.feat_stopwords else set()
 
-        self.stemmer = SnowballStemmer('english')
+        # Each word is only stemmed once, the table is shared between all instances
+        self.stemmer = get_stemmer('english', args.stem_cache)
+
+        # Cache of the tokenized/stemmed lyrics, shared between iterations and runs
+        self.token_cache = TokenCache(args.token_cache, args.cache_size * 2**20) if args.token_cache else None
 
         self.num_chars = int(args.num_chars)
         self.num_words = int(args.num_words)
@@ -59,6 +87,19 @@ class Classy(NaiveBayesClassifier):
 
         self.show_stats = args.stats
 
+        # Number of processes used to extract features
+        self.jobs = args.jobs
+
+        # Tokenize all songs once and keep the result in the corpus, see 'preprocess'
+        self.preprocessed = args.preprocess
+        # Ids of the n-grams in the preprocessed corpus
+        self.vocabulary = None
+
+        # 'dict' uses the nltk classifier with one dict per song, 'sparse' stores the songs as rows in a sparse matrix
+        self.backend = args.backend
+        # Naive Bayes event model for the sparse backend, 'bernoulli' or 'multinomial'
+        self.event_model = args.event_model
+
         self.num_prints = 0
 
     def _print(self, msg='', end='\n'):
@@ -68,263 +109,613 @@ class Classy(NaiveBayesClassifier):
         print(msg, end=end)
         self.num_prints += 1
 
-    def features_grams(self, lyrics):
-        uni_grams = []
-        bi_grams = set()
-        tri_grams = set()
-        four_grams = set()
-        five_grams = set()
-        meta_data = []
-        no_meta_lyrics = ""
-        for line in lyrics.split('\n'):
-            line = line.rstrip()
-            if len(line) <= 1:
-                continue
-            if line[0] + line[-1] == '[]':
-                meta_data.append(line[1:-1].lower())
-                continue
-            no_meta_lyrics += line + ' '
-            words = line.split(' ')
-            for idx, word in enumerate(words):
-                word = word.rstrip()
-                # Ignore double space
-                if len(word) > 0:
-                    uni_grams.append(word)
-                    # Speed up by not checking further
-                    if not self.feat_n_gram:
-                        continue
-                    if idx >= 1:
-                        bi_grams.add('|'.join(words[idx-1:idx+1]))
-                    if idx >= 2:
-                        tri_grams.add('|'.join(words[idx-2:idx+1]))
-                    if idx >= 3:
-                        four_grams.add('|'.join(words[idx-3:idx+1]))
-                    if idx >= 4:
-                        five_grams.add('|'.join(words[idx-4:idx+1]))
-
-        if self.feat_tokenize:
-            words_tokenize = word_tokenize(no_meta_lyrics)
-        else:
-            words_tokenize = uni_grams
+    def features_grams(self, lyrics, all_orders=False, n_grams=True):
+        '''
+        All n-grams in the lyrics, each as a Counter with the number of occurrences, and the lines without metadata.
+        Bigrams and up are only extracted if used, or if 'all_orders' is set, and not if 'n_grams' is False.
+        '''
+        uni_grams, bi_grams, tri_grams, four_grams, five_grams, meta_data, no_meta_lines = lyrics_grams(lyrics, (self.feat_n_gram or all_orders) and n_grams, self.hash_bits)
 
-        if self.feat_stem:
-            words_stem = [self.stemmer.stem(word) for word in words_tokenize]
+        if self.feat_tokenize or self.feat_stem:
+            words_stem = self.unigram_words(' '.join(no_meta_lines) + ' ')
         else:
-            words_stem = words_tokenize
+            words_stem = uni_grams
+
+        return Counter(words_stem), bi_grams, tri_grams, four_grams, five_grams, meta_data, no_meta_lines
 
-        return set(words_stem), bi_grams, tri_grams, four_grams, five_grams, meta_data
+    def unigram_words(self, text):
+        '''
+        Tokenize and/or stem 'text', from the token cache if it is used.
+        '''
+        stemmer = self.stemmer if self.feat_stem else None
+        if self.token_cache is not None:
+            return self.token_cache.tokens(text, self.feat_tokenize, stemmer)
+        return tokenize(text, self.feat_tokenize, stemmer)
 
     def features_meta(self, meta_data):
-        meta_members = {
-            'verse': 0, 'chorus': 0, 'intro': 0, 'outro': 0,
-            'break':0, 'bridge': 0, 'skit': 0, 'hook': 0,
-            'drop': 0, 'interlude': 0, 'breakdown': 0,
-            'pre-chorus': 0,
-            }
-
-        for item in meta_data:
-            if 'refrain' in item:
-                item = 'chorus'
-            for key in meta_members.keys():
-                if key in item:
-                    meta_members[key] += 1
-        return meta_members
-
-    def get_features_for_song(self, song):
+        return meta_counts(meta_data)
+
+    def song_data(self, song, full=False, lines=False):
         '''
-        The features extracted are defined here.
+        Everything the features of a song are computed from.
+        The lyrics are only tokenized here, so the result can be reused when the selected n-grams change.
+        If 'full', the data needed by all features is computed, not only the used ones.
+        If 'lines', the words of each line are kept in 'lines' instead of the n-grams as strings
+        (hashed n-grams are still extracted), for 'Vocabulary.intern_lines'.
         '''
+        strings = not lines or self.hash_bits
+        uni_grams, bi_grams, tri_grams, four_grams, five_grams, meta_data, no_meta_lines = self.features_grams(song['lyrics'], full, strings)
+
+        data = {
+            'grams': {
+                'uni': uni_grams,
+                'bi': bi_grams,
+                'tri': tri_grams,
+                'four': four_grams,
+                'five': five_grams,
+            },
+            'meta': meta_data,
+        }
+        if not strings:
+            data['lines'] = [line.split(' ') for line in no_meta_lines]
 
-        uni_grams, bi_grams, tri_grams, four_grams, five_grams, meta_data = self.features_grams(song['lyrics'])
+        # Considers number of characters, number of words and number of unique words
+        if full or self.num_chars > 0 or self.num_words > 0 or self.num_unique > 0:
+            data.update(lyrics_sizes(song['lyrics']))
+
+        return data
+
+    def get_features_for_song(self, song, data=None):
+        '''
+        The features extracted are defined here.
+        If 'data' (from 'song_data') is given, the song is not tokenized again.
+        '''
+        data = self.song_data(song) if data is None else data
+        if 'ids' in data:
+            return self.get_features_from_ids(data)
+        grams = data['grams']
 
         features = {}
         # Occurency of a unigram or not in a song
         for uni_gram in self.common_uni_grams:
-            features['uni({})'.format(uni_gram)] = (uni_gram in uni_grams)
+            features['uni({})'.format(uni_gram)] = (uni_gram in grams['uni'])
 
         # Occurency of a bigram or not in a song
         if self.feat_bi_gram:
             for bi_gram in self.common_bi_grams:
-                features['bi({})'.format(bi_gram)] = (bi_gram in bi_grams)
+                features['bi({})'.format(bi_gram)] = (bi_gram in grams['bi'])
 
         # Occurency of a trigram or not in a song
         if self.feat_tri_gram:
             for tri_gram in self.common_tri_grams:
-                features['tri({})'.format(tri_gram)] = (tri_gram in tri_grams)
+                features['tri({})'.format(tri_gram)] = (tri_gram in grams['tri'])
 
         # Occurency of a four-gram or not in a song
         if self.feat_four_gram:
-            #print('JJJJJ?')
-            #input()
             for four_gram in self.common_four_grams:
-                features['four({})'.format(four_gram)] = (four_gram in four_grams)
+                features['four({})'.format(four_gram)] = (four_gram in grams['four'])
 
         # Occurency of a five-gram or not in a song
         if self.feat_five_gram:
             for five_gram in self.common_five_grams:
-                features['five({})'.format(five_gram)] = (five_gram in five_grams)
+                features['five({})'.format(five_gram)] = (five_gram in grams['five'])
 
         # Types of metadata in lyrics. Count all of them to keep tack of how song is structured.
         if self.feat_meta:
-            for item, cnt in self.features_meta(meta_data).items():
+            for item, cnt in self.features_meta(data['meta']).items():
                 features[item] = cnt
 
-        # Considers number of characters, number of words and number of unique words
         # If the values are provided that number is the threshold value
-        tokenized_lyrics = nltk.wordpunct_tokenize(song['lyrics'])
-
-        _chars = len(song['lyrics'])
-        _words = len(tokenized_lyrics)
-        _unique = len(set(tokenized_lyrics))
-
         if self.num_chars > 0:
-            features['chars({})'.format(self.num_chars)] = (_chars <= self.num_chars)
+            features['chars({})'.format(self.num_chars)] = (data['chars'] <= self.num_chars)
 
         if self.num_words > 0:
-            features['words({})'.format(self.num_words)] = (_words <= self.num_words)
+            features['words({})'.format(self.num_words)] = (data['words'] <= self.num_words)
 
         if self.num_unique > 0:
-            features['unique({})'.format(self.num_unique)] = (_unique <= self.num_unique)
+            features['unique({})'.format(self.num_unique)] = (data['unique'] <= self.num_unique)
+
+        return features
+
+    def get_features_from_ids(self, data):
+        '''
+        'get_features_for_song' for the interned data of a preprocessed song.
+        The feature names are the names of the columns in the feature space.
+        '''
+        row = self.id_row(data['ids'])
+        features = {}
+        for prefix in orders:
+            for column in self.space.columns.get(prefix, {}).values():
+                features[self.space.names[column]] = (column in row)
+
+        if self.feat_meta:
+            for item, cnt in self.features_meta(data['meta']).items():
+                features[item] = cnt
+
+        for name, threshold in [('chars', self.num_chars), ('words', self.num_words), ('unique', self.num_unique)]:
+            if threshold > 0:
+                features['{}({})'.format(name, threshold)] = (data[name] <= threshold)
 
         return features
 
-    def extract_features(self, data_set, name):
+    def id_row(self, song_ids):
+        '''
+        Columns (column -> count) of the selected n-grams in a song, from the arrays of n-gram ids
+        '''
+        row = {}
+        for prefix, lookup in self.id_columns.items():
+            ids, counts = song_ids[prefix]
+            columns = lookup[np.frombuffer(ids, dtype=np.uint32)]
+            present = columns >= 0
+            row.update(zip(columns[present].tolist(), np.frombuffer(counts, dtype=np.uint32)[present].tolist()))
+        return row
+
+    def get_row_for_song(self, song, data=None):
+        '''
+        Same features as 'get_features_for_song' but as a row in the sparse feature space.
+        Returns the row (column -> count) and the meta counts.
+        '''
+        data = self.song_data(song) if data is None else data
+        grams = {} if 'ids' in data else dict(data['grams'])
+
+        # Thresholds on number of characters, words and unique words are columns which are set if below threshold
+        for name, threshold in [('chars', self.num_chars), ('words', self.num_words), ('unique', self.num_unique)]:
+            if threshold > 0 and data[name] <= threshold:
+                grams[name] = {threshold: 1}
+
+        meta = self.features_meta(data['meta']) if self.feat_meta else None
+        row = self.space.row(grams)
+        if 'ids' in data:
+            row.update(self.id_row(data['ids']))
+        return row, meta
+
+    def build_feature_space(self):
+        '''
+        Give each selected n-gram (and threshold feature) a column in the sparse feature space.
+        '''
+        self.space = FeatureSpace()
+        # In order of rank, the unigrams for a smaller threshold are the first columns
+        self.space.add('uni', self.ranked_uni_grams, sort=False)
+        if self.feat_bi_gram:
+            self.space.add('bi', self.common_bi_grams)
+        if self.feat_tri_gram:
+            self.space.add('tri', self.common_tri_grams)
+        if self.feat_four_gram:
+            self.space.add('four', self.common_four_grams)
+        if self.feat_five_gram:
+            self.space.add('five', self.common_five_grams)
+        if self.num_chars > 0:
+            self.space.add('chars', [self.num_chars])
+        if self.num_words > 0:
+            self.space.add('words', [self.num_words])
+        if self.num_unique > 0:
+            self.space.add('unique', [self.num_unique])
+
+        self.meta_names = list(self.features_meta([]).keys()) if self.feat_meta else []
+
+        # Column of each n-gram id (-1 if not selected), for the preprocessed songs
+        self.id_columns = {}
+        if self.preprocessed and self.vocabulary is not None:
+            for order, prefix in enumerate(orders, 1):
+                if prefix not in self.space.columns:
+                    continue
+                lookup = np.full(self.vocabulary.size(order), -1, dtype=np.int64)
+                for gram, column in self.space.columns[prefix].items():
+                    idx = self.vocabulary.lookup(order, gram)
+                    if idx is not None:
+                        lookup[idx] = column
+                self.id_columns[prefix] = lookup
+
+    def map_songs(self, method, data_set, name):
+        '''
+        Call 'method' for each song in the dataset, yields (song, result) in the same order as the songs.
+        If 'jobs' is more than 1, the songs are sent in chunks to a pool of worker processes.
+        '''
+        if self.jobs <= 1:
+            results = (getattr(self, method)(song) for song in data_set)
+        else:
+            chunk_size = max(1, min(100, len(data_set) // (4 * self.jobs)))
+            pool = Pool(self.jobs, initializer=_init_worker, initargs=(self._worker_state(),))
+            results = pool.imap(partial(_call_worker, method), data_set, chunk_size)
+
+        try:
+            for idx, (song, result) in enumerate(zip(data_set, results)):
+                progressbar((idx+1)/len(data_set), 'Features {} {}/{}'.format(name, idx+1, len(data_set)))
+                yield song, result
+        finally:
+            if self.jobs > 1:
+                pool.close()
+                pool.join()
+
+    def map_stream(self, method, songs, name, chunk_size=1000, verbose=True):
+        '''
+        Same as 'map_songs' for an iterable of songs of unknown length.
+        The songs are read 'chunk_size' at a time, so only one chunk of lyrics is in memory.
+        The worker processes are started once for the whole stream.
+        If 'verbose', the number of songs done is shown.
+        '''
+        pool = Pool(self.jobs, initializer=_init_worker, initargs=(self._worker_state(),)) if self.jobs > 1 else None
+        songs = iter(songs)
+        num_songs = 0
+        try:
+            while True:
+                chunk = list(islice(songs, chunk_size))
+                if not chunk:
+                    break
+                if pool is None:
+                    results = (getattr(self, method)(song) for song in chunk)
+                else:
+                    results = pool.imap(partial(_call_worker, method), chunk, max(1, len(chunk) // (4 * self.jobs)))
+                for song, result in zip(chunk, results):
+                    yield song, result
+                num_songs += len(chunk)
+                if verbose:
+                    print('\033[KFeatures {} {}'.format(name, num_songs), end='\r')
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+
+    def _worker_state(self):
+        '''
+        Copy of the classifier without the songs, sent to the worker processes.
+        '''
+        state = copy(self)
+        for attr in ['corpus', 'train_raw', 'test_raw', 'train_set', 'test_set', 'model', 'vocabulary', 'id_columns']:
+            state.__dict__.pop(attr, None)
+        return state
+
+    def extract_rows(self, data_set, name, song_data=None):
+        '''
+        For each song in the dataset, extract all features as a row in a sparse matrix.
+        If 'song_data' is given, the features are computed from it instead of the lyrics.
+        '''
+        rows = SparseSet(len(self.space), self.meta_names)
+        names = []
+        with profiling.stage('features {}'.format(name)):
+            if song_data is None:
+                results = self.map_songs('get_row_for_song', data_set, name)
+            else:
+                results = ((song, self.get_row_for_song(song, data)) for song, data in zip(data_set, song_data))
+            for song, (row, meta) in results:
+                rows.append(row, meta, song['genre'])
+                names.append(song['name'])
+                profiling.count('nonzero', len(row))
+            profiling.count('songs', len(names))
+        self._print()
+        return names, rows
+
+    def extract_features(self, data_set, name, song_data=None):
         '''
         For each song in the dataset, extract all features.
+        If 'song_data' is given, the features are computed from it instead of the lyrics.
         '''
         features = []
         names = []
-        for idx, song in enumerate(data_set):
-            progressbar((idx+1)/len(data_set), 'Features {} {}/{}'.format(name, idx+1, len(data_set)))
-            features.append([
-                self.get_features_for_song(song),
-                song['genre'],
-            ])
-            names.append(song['name'])
+        with profiling.stage('features {}'.format(name)):
+            if song_data is None:
+                results = self.map_songs('get_features_for_song', data_set, name)
+            else:
+                results = ((song, self.get_features_for_song(song, data)) for song, data in zip(data_set, song_data))
+            for song, song_features in results:
+                features.append([
+                    song_features,
+                    song['genre'],
+                ])
+                names.append(song['name'])
+                profiling.count('features', len(song_features))
+            profiling.count('songs', len(names))
         self._print()
         return names, features
 
-    def extract_data_training(self):
-        # All words with their frequency in the train set.
-        # Avoid to look at test data (no cheating)
-        uni_grams = []
-        bi_grams = []
-        tri_grams = []
-        four_grams = []
-        five_grams = []
-        no_meta_lyrics = ''
-        for idx, song in enumerate(self.train_raw):
-            for line in song['lyrics'].split('\n'):
-                if len(line) <= 1:
-                    continue
-                line = line.rstrip()
-                # Exist metadata about structure of song.
-                # This data can contain name of artist (which is cheating to train on)
-                if line[0] + line[-1] == '[]':
-                    continue
-                no_meta_lyrics += line + ' '
-
-                words = line.split(' ')
-                for idx, word in enumerate(words):
-                    word = word.rstrip()
-                    # Ignore double space
-                    if len(word) >= 1:
-                        uni_grams.append(word)
-                        # Speed up by not checking further
-                        if not self.feat_n_gram:
-                            continue
-                        if idx >= 1:
-                            bi_grams.append('|'.join(words[idx-1:idx+1]))
-                        if idx >= 2:
-                            tri_grams.append('|'.join(words[idx-2:idx+1]))
-                        if idx >= 3:
-                            four_grams.append('|'.join(words[idx-3:idx+1]))
-                        if idx >= 4:
-                            five_grams.append('|'.join(words[idx-4:idx+1]))
-
-        return uni_grams, bi_grams, tri_grams, four_grams, five_grams, no_meta_lyrics
+    def ngram_counter(self, vocabulary=None):
+        '''
+        Counter for the n-grams needed by the features.
+        With a 'vocabulary' it counts the interned n-grams of preprocessed songs.
+        '''
+        return NgramCounter(5 if self.feat_n_gram else 1, self.feat_tokenize, self.stemmer if self.feat_stem else None, self.token_cache, self.hash_bits, vocabulary)
+
+    def select_ngrams(self, counter):
+        '''
+        The most common n-grams in 'counter', ignores n-grams which only occur once.
+        Stopwords are ignored for the unigrams.
+        '''
+        self.ranked_uni_grams = counter.top_ranked(1, self.num_features_uni, self.stopwords if self.feat_stopwords else None)
+        self.common_uni_grams = set(self.ranked_uni_grams)
+        if self.feat_n_gram:
+            self.common_bi_grams = counter.top(2, self.num_features_bi)
+            self.common_tri_grams = counter.top(3, self.num_features_tri)
+            self.common_four_grams = counter.top(4, self.num_features_four)
+            self.common_five_grams = counter.top(5, self.num_features_five)
+        else:
+            self.common_bi_grams = set()
+            self.common_tri_grams = set()
+            self.common_four_grams = set()
+            self.common_five_grams = set()
+
+    def build_sets(self, train_data=None, test_data=None):
+        '''
+        Create train and test set from 'train_raw' and 'test_raw'
+        'train_data' and 'test_data' are optional precomputed 'song_data' for the songs.
+        '''
+        # The dict features of interned songs are also found by column
+        if self.backend == 'sparse' or self.preprocessed:
+            self.build_feature_space()
+        if self.backend == 'sparse':
+            self.train_names, self.train_set = self.extract_rows(self.train_raw, 'train', train_data)
+            self.test_names, self.test_set = self.extract_rows(self.test_raw, 'test', test_data)
+        else:
+            self.train_names, self.train_set = self.extract_features(self.train_raw, 'train', train_data)
+            self.test_names, self.test_set = self.extract_features(self.test_raw, 'test', test_data)
+
+    def preprocess_song(self, song):
+        '''
+        Tokenize a song once for all feature settings, see 'preprocess'.
+        Only the hashed n-grams are extracted here, the others are made from the ids of the words in 'lines'.
+        '''
+        return {
+            'flags': (self.feat_tokenize, self.feat_stem, self.hash_bits),
+            'grams': song_grams(song['lyrics'], 5 if self.hash_bits else 1, self.feat_tokenize, self.stemmer if self.feat_stem else None, self.token_cache, self.hash_bits),
+            'lines': None if self.hash_bits else song_lines(song['lyrics']),
+            'data': self.song_data(song, full=True, lines=True),
+        }
+
+    def preprocess(self):
+        '''
+        Tokenize all songs in the corpus and store the n-grams in the songs ('cache').
+        Everything that depends on the thresholds or the other feature flags is computed from the cache,
+        so the same corpus can be reused by runs which only differ in those.
+        Songs already preprocessed with the same tokenize/stem settings are skipped.
+        The words are interned in a vocabulary shared by the songs and the n-grams are made from
+        the ids of the words ('Vocabulary.intern_lines'), each song only keeps arrays of ids.
+        '''
+        flags = (self.feat_tokenize, self.feat_stem, self.hash_bits)
+        songs = []
+        for song in self.corpus:
+            cache = song.get('cache', {})
+            if cache.get('flags') != flags:
+                songs.append(song)
+            elif self.vocabulary is None:
+                self.vocabulary = cache['vocabulary']
+        if self.vocabulary is None:
+            self.vocabulary = Vocabulary(len(orders), self.hash_bits > 0)
+        if not songs:
+            return
+        with profiling.stage('preprocess'):
+            for song, cache in self.map_songs('preprocess_song', songs, 'preprocess'):
+                cache['vocabulary'] = self.vocabulary
+                lines = cache.pop('lines')
+                if lines is None:
+                    cache['grams'] = self.vocabulary.intern_all(cache['grams'])
+                else:
+                    cache['grams'] = [self.vocabulary.intern(1, cache['grams'][0])] + self.vocabulary.intern_lines(lines, len(orders))
+                data = cache['data']
+                grams = data.pop('grams')
+                data_lines = data.pop('lines', None)
+                if data_lines is None:
+                    ids = self.vocabulary.intern_all([grams[prefix] for prefix in orders], cache['grams'])
+                else:
+                    # Mostly the same lines as for counting, then the n-grams are only interned once
+                    n_grams = cache['grams'][1:] if data_lines == lines else self.vocabulary.intern_lines(data_lines, len(orders))
+                    ids = self.vocabulary.share([self.vocabulary.intern(1, grams['uni'])] + n_grams, cache['grams'])
+                data['ids'] = dict(zip(orders, ids))
+                song['cache'] = cache
+            profiling.count('songs', len(songs))
+            profiling.count('vocabulary', sum(self.vocabulary.size(order) for order in range(1, len(orders)+1)))
+        self._print()
 
     def split_train_test(self):
         self._print('Preprocessing data')
+        if self.preprocessed:
+            self.preprocess()
         len_train = int(self.percent * len(self.corpus))
         self.train_raw = self.corpus[:len_train]
         self.test_raw = self.corpus[len_train:]
 
-        uni_grams, bi_grams, tri_grams, four_grams, five_grams, no_meta_lyrics = self.extract_data_training()
-
-        if self.feat_tokenize:
-            words_tokenize = word_tokenize(no_meta_lyrics)
+        # All n-grams with their frequency in the train set.
+        # Avoid to look at test data (no cheating)
+        with profiling.stage('count'):
+            counter = self.ngram_counter(self.vocabulary if self.preprocessed else None)
+            for song in self.train_raw:
+                counter.add(song['lyrics'], song['cache']['grams'] if self.preprocessed else None)
+            profiling.count('songs', counter.num_songs)
+            profiling.count('tokens', counter.total(1))
+
+        with profiling.stage('select'):
+            self.select_ngrams(counter)
+        if self.preprocessed:
+            self.build_sets([song['cache']['data'] for song in self.train_raw], [song['cache']['data'] for song in self.test_raw])
         else:
-            words_tokenize = uni_grams
+            self.build_sets()
 
-        if self.feat_stem:
-            words_stem = [self.stemmer.stem(word) for word in words_tokenize]
-        else:
-            words_stem = words_tokenize
-
-        unique_uni_grams = Counter(words_stem)
-        unique_bi_grams = Counter(bi_grams)
-        unique_tri_grams = Counter(tri_grams)
-        unique_four_grams = Counter(four_grams)
-        unique_five_grams = Counter(five_grams)
-
-        # unique_unigrams is dict with (word: count). Is sorted by count and adds features until the number of features are fulfilled
-        # Ignores stopwords.
-        self.common_uni_grams = set()
-        for word, value in sorted(unique_uni_grams.items(), key=operator.itemgetter(1), reverse=True):
-            if value == 1:
-                continue
-            if len(self.common_uni_grams) >= self.num_features_uni:
-                break
-            if (self.feat_stopwords) and (word.lower() in self.stopwords):
-                continue
-            self.common_uni_grams.add(word)
-
-        # Bigrams
-        self.common_bi_grams = set()
-        for word, value in sorted(unique_bi_grams.items(), key=operator.itemgetter(1), reverse=True):
-            if value == 1:
-                continue
-            if len(self.common_bi_grams) >= self.num_features_bi:
-                break
-            self.common_bi_grams.add(word)
-
-        # Trigrams
-        self.common_tri_grams = set()
-        for word, value in sorted(unique_tri_grams.items(), key=operator.itemgetter(1), reverse=True):
-            if value == 1:
-                continue
-            if len(self.common_tri_grams) >= self.num_features_tri:
-                break
-            self.common_tri_grams.add(word)
-
-        # Four-grams
-        self.common_four_grams = set()
-        for word, value in sorted(unique_four_grams.items(), key=operator.itemgetter(1), reverse=True):
-            if value == 1:
-                continue
-            if len(self.common_four_grams) >= self.num_features_four:
-                break
-            self.common_four_grams.add(word)
-
-        # Five-grams
-        self.common_five_grams = set()
-        for word, value in sorted(unique_five_grams.items(), key=operator.itemgetter(1), reverse=True):
-            if value == 1:
-                continue
-            if len(self.common_five_grams) >= self.num_features_five:
-                break
-            self.common_five_grams.add(word)
+    def song_grams(self, song):
+        '''
+        All n-grams of a song for the features, see 'ngrams.song_grams'. Used by 'stream_train_test'.
+        '''
+        return song_grams(song['lyrics'], 5 if self.feat_n_gram else 1, self.feat_tokenize, self.stemmer if self.feat_stem else None, self.token_cache, self.hash_bits)
 
-        # Create train and test set
-        self.train_names, self.train_set = self.extract_features(self.train_raw, 'train')
-        self.test_names, self.test_set = self.extract_features(self.test_raw, 'test')
+    def stream_train_test(self, songs, seed=0, chunk_size=1000):
+        '''
+        Same as 'split_train_test' for a corpus which does not fit in memory, uses the sparse backend.
+        'songs' is a function which returns a new iterator over the songs, it is read twice:
+        once to count the n-grams in the train set, once to extract the rows of all songs.
+        Songs are split with 'in_train_set' instead of shuffled, the split changes with 'seed'.
+        Only the rows (and names) of the songs are kept, not the lyrics.
+        '''
+        self.backend = 'sparse'
+        self.corpus = []
+
+        self._print('Counting n-grams')
+        with profiling.stage('count'):
+            counter = self.ngram_counter()
+            train_songs = (song for song in songs() if in_train_set(song['name'], self.percent, seed))
+            for song, grams in self.map_stream('song_grams', train_songs, 'count', chunk_size):
+                counter.add(song['lyrics'], grams)
+            profiling.count('songs', counter.num_songs)
+            profiling.count('tokens', counter.total(1))
+        self._print()
+
+        with profiling.stage('select'):
+            self.select_ngrams(counter)
+        del counter
+
+        self.build_feature_space()
+        self.train_raw = []
+        self.test_raw = []
+        self.train_names, self.train_set = [], SparseSet(len(self.space), self.meta_names)
+        self.test_names, self.test_set = [], SparseSet(len(self.space), self.meta_names)
+        with profiling.stage('features'):
+            for song, (row, meta) in self.map_stream('get_row_for_song', songs(), 'all', chunk_size):
+                if in_train_set(song['name'], self.percent, seed):
+                    names, data_set = self.train_names, self.train_set
+                else:
+                    names, data_set = self.test_names, self.test_set
+                data_set.append(row, meta, song['genre'])
+                names.append(song['name'])
+                profiling.count('nonzero', len(row))
+            profiling.count('songs', len(self.train_names) + len(self.test_names))
+        self._print()
+
+    def cross_validate(self, num_folds):
+        '''
+        K-fold cross validation on the corpus, returns the accuracy and stats for each fold.
+        Each song is tokenized once. The n-gram counts of the train set of a fold are the
+        counts of the whole corpus minus the counts of the songs in the fold. Ties are ranked
+        by the first occurrence in the train songs, as in 'split_train_test'.
+        '''
+        self._print('Preprocessing data')
+        with profiling.stage('count'):
+            counter = self.ngram_counter()
+            song_grams = []
+            # Positions of the counter before each song
+            marks = []
+            for idx, song in enumerate(self.corpus):
+                progressbar((idx+1)/len(self.corpus), 'Counting {}/{}'.format(idx+1, len(self.corpus)))
+                grams = counter.song_grams(song['lyrics'])
+                marks.append(counter.positions())
+                counter.update(grams)
+                song_grams.append(grams)
+            profiling.count('songs', len(song_grams))
+            profiling.count('tokens', counter.total(1))
+        self._print()
+        song_data = [data for song, data in self.map_songs('song_data', self.corpus, 'all')]
+        self._print()
+
+        accuracies = []
+        stats = []
+        for fold in range(num_folds):
+            start = fold * len(self.corpus) // num_folds
+            stop = (fold + 1) * len(self.corpus) // num_folds
+
+            # Remove the test songs from the counts while selecting n-grams
+            with profiling.stage('select'):
+                for grams in song_grams[start:stop]:
+                    counter.update(grams, -1)
+                counter.first_seen(marks[start], song_grams[stop:])
+                self.select_ngrams(counter)
+                counter.first_seen()
+                for grams in song_grams[start:stop]:
+                    counter.update(grams)
+
+            self.train_raw = self.corpus[:start] + self.corpus[stop:]
+            self.test_raw = self.corpus[start:stop]
+            self.build_sets(song_data[:start] + song_data[stop:], song_data[start:stop])
+
+            self._print('Fold {}/{}'.format(fold+1, num_folds))
+            self.train()
+            self.test()
+            accuracies.append(self.accuracy)
+            stats.append(self.stats)
+        return accuracies, stats
+
+    def sweep(self, thresholds):
+        '''
+        Accuracy for each unigram threshold in 'thresholds' with one trained model, uses the sparse backend.
+        The model is trained with the largest threshold. The unigrams selected with a smaller threshold
+        are the first in the ranked list, so the model for them is the trained model restricted to those columns.
+        Returns dict with threshold -> accuracy.
+        '''
+        self.backend = 'sparse'
+        self.num_features_uni = max(thresholds)
+        self.split_train_test()
+        self.train()
+
+        uni_columns = [self.space.columns['uni'][gram] for gram in self.ranked_uni_grams]
+        true_genres = self.test_set.genres
+        self.sweep_accuracy = {}
+        for threshold in sorted(thresholds):
+            columns = np.ones(len(self.space), dtype=bool)
+            columns[uni_columns[threshold:]] = False
+            pred_genres = self.model.predict(self.test_set, columns)
+            correct = sum(true == pred for true, pred in zip(true_genres, pred_genres))
+            # No test songs, same as 'test'
+            self.sweep_accuracy[threshold] = correct / len(true_genres) if true_genres else 0
+            self._print('Unigrams: {:>6}, Accuracy: {:.2f}%'.format(threshold, 100*self.sweep_accuracy[threshold]))
+
+        self.accuracy = self.sweep_accuracy[max(thresholds)]
+        self.stats = []
+        return self.sweep_accuracy
+
+    def fit_all(self):
+        '''
+        Train the model on all songs in the corpus, used to classify new songs with 'classify_batch'.
+        '''
+        self.percent = 1
+        self.split_train_test()
+        self.train()
+
+    def classify_batch(self, lyrics_iterable, chunk_size=1000):
+        '''
+        Classify new songs with the trained model.
+        'lyrics_iterable' is an iterable of lyrics (str) or songs (dict with 'lyrics').
+        It is read in chunks of 'chunk_size' songs and each chunk is scored at once,
+        so only one chunk is kept in memory.
+        Yields (song, genre, log_prob) where 'log_prob' is a dict with the normalized
+        log probability (base 2, as in nltk) of each genre.
+        '''
+        # Items read by 'map_stream' but not yet yielded, at most about two chunks
+        items = deque()
+        def songs():
+            for item in lyrics_iterable:
+                items.append(item)
+                yield item if isinstance(item, dict) else {'lyrics': item}
+
+        method = 'get_row_for_song' if self.backend == 'sparse' else 'get_features_for_song'
+        results = self.map_stream(method, songs(), 'batch', chunk_size, verbose=False)
+        while True:
+            chunk = list(islice(results, chunk_size))
+            if not chunk:
+                break
+            chunk_items = [items.popleft() for _ in chunk]
+
+            if self.backend == 'sparse':
+                data_set = SparseSet(len(self.space), self.meta_names)
+                for song, (row, meta) in chunk:
+                    data_set.append(row, meta, None)
+                for item, scores in zip(chunk_items, self.model.log_posterior(data_set)):
+                    yield item, self.model.genres[scores.argmax()], dict(zip(self.model.genres, scores.tolist()))
+            else:
+                for item, (song, features) in zip(chunk_items, chunk):
+                    prob = self.model.prob_classify(features)
+                    yield item, prob.max(), {genre: prob.logprob(genre) for genre in prob.samples()}
 
     def show_features(self, n):
         '''
         Show the n most important features
         '''
-        self.model.show_most_informative_features(n)
+        if self.backend == 'sparse':
+            self.show_sparse_features(n)
+        else:
+            self.model.show_most_informative_features(n)
+
+    def show_sparse_features(self, n):
+        '''
+        Same as 'show_most_informative_features' in nltk, for the binary columns.
+        The ratio between the most and least likely genre given that the feature is present.
+        '''
+        print('Most Informative Features')
+        for column, high, low, ratio in self.model.most_informative(n):
+            print('{:>30} = True {:>12} : {:<12} = {:8.1f} : 1.0'.format(self.space.names[column], high, low, ratio))
 
     def train(self):
         '''
@@ -333,7 +724,12 @@ class Classy(NaiveBayesClassifier):
         I have locally added a progressbar in the nltk training method.
         '''
         self._print('Training', end='\r')
-        self.model = nltk.NaiveBayesClassifier.train(self.train_set)
+        with profiling.stage('train'):
+            if self.backend == 'sparse':
+                self.model = NaiveBayes(self.event_model).fit(self.train_set)
+            else:
+                self.model = nltk.NaiveBayesClassifier.train(self.train_set)
+            profiling.count('songs', len(self.train_set))
 
     def test_old(self):
         '''
@@ -345,6 +741,14 @@ class Classy(NaiveBayesClassifier):
         self._print('Accuracy: {:.2f}%'.format(100*self.accuracy))
         self._print()
 
+    def classify_songs(self, data_set):
+        '''
+        Classify the songs one at a time with the nltk model, yields (true genre, predicted genre)
+        '''
+        for idx, (lyrics_features, true_genre) in enumerate(data_set):
+            progressbar((idx+1)/len(data_set), 'Testing {}/{}'.format(idx+1, len(data_set)))
+            yield true_genre, self.model.classify(lyrics_features)
+
     def test(self):
         '''
         Evaluate all documents and calculate accuracy for them.
@@ -358,19 +762,26 @@ class Classy(NaiveBayesClassifier):
         result = []
         true_set = defaultdict(set)
         pred_set = defaultdict(set)
-        for idx, (lyrics_features, true_genre) in enumerate(self.test_set):
-            progressbar((idx+1)/len(self.test_set), 'Testing {}/{}'.format(idx+1, len(self.test_set)))
-            pred_genre = self.model.classify(lyrics_features)
-
-            true_set[true_genre].add(idx)
-            pred_set[pred_genre].add(idx)
-            result.append(true_genre == pred_genre)
-
-            # Name of current test song
-            #self.test_names[idx]
+        with profiling.stage('test'):
+            if self.backend == 'sparse':
+                # All songs are scored at once
+                progressbar(1, 'Testing {}/{}'.format(len(self.test_set), len(self.test_set)))
+                predictions = zip(self.test_set.genres, self.model.predict(self.test_set))
+            else:
+                predictions = self.classify_songs(self.test_set)
+
+            for idx, (true_genre, pred_genre) in enumerate(predictions):
+                true_set[true_genre].add(idx)
+                pred_set[pred_genre].add(idx)
+                result.append(true_genre == pred_genre)
+
+                # Name of current test song
+                #self.test_names[idx]
+            profiling.count('songs', len(result))
 
         self._print()
-        self.accuracy = sum(result) / len(result)
+        # No test songs (like '--split 100'), the accuracy is 0
+        self.accuracy = sum(result) / len(result) if result else 0
 
         self._print('Accuracy: {:.2f}%'.format(100*self.accuracy))
         self._print()
@@ -0,0 +1,245 @@
+'''
+Performance benchmark of the classifier on generated lyrics, runs without the lyrics folder or network.
+The songs are made up from a seeded generator: sections like [Verse 1] and [Chorus] (repeated),
+words drawn from a Zipf distribution where each genre prefers some of the words. The same seed
+and size always give the same corpus, so the timings and the accuracy can be compared between runs.
+
+Each configuration (backend, features, corpus size) is run through the stages of 'Classy'
+(count, select, features train/test, train, test) with the stages timed by 'profiling.py'.
+The result can be saved as a baseline, later runs are compared with it and stages which
+got slower (or used more memory) than the tolerance are reported as regressions.
+
+    python benchmark.py --save_baseline
+    python benchmark.py                     # compare with benchmark-baseline.json
+'''
+
+from classify import parse_args as classify_args
+from bayes import Classy
+from contextlib import redirect_stdout
+from itertools import accumulate
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import time
+import profiling
+
+genres = ['pop', 'rap', 'rock', 'country', 'electronic']
+syllables = ['ba', 'ke', 'lo', 'mi', 'nu', 'ra', 'se', 'ti', 'vo', 'za', 'an', 'el', 'in', 'or', 'ul', 'sha', 'tro', 'ny', 'qui', 'dar']
+sections = ['Intro', 'Verse 1', 'Chorus', 'Verse 2', 'Chorus', 'Bridge', 'Chorus', 'Outro']
+
+# Configurations run by default, (backend, features)
+default_configs = [
+    ('dict', []),
+    ('sparse', []),
+    ('sparse', ['bigram', 'trigram', 'meta']),
+]
+
+# Stages compared with the baseline, as named by 'Classy'
+stages = ['count', 'select', 'features train', 'features test', 'train', 'test']
+
+def make_vocabulary(rng, size):
+    '''
+    'size' different made up words, shorter words are more common
+    '''
+    words = []
+    seen = set()
+    length = 1
+    while len(words) < size:
+        word = ''.join(rng.choice(syllables) for _ in range(length))
+        if word not in seen:
+            seen.add(word)
+            words.append(word)
+        # The short words run out, move on to longer words
+        elif rng.random() < 0.1:
+            length += 1
+    return words
+
+def generate_corpus(num_songs, seed=0, vocabulary_size=20000, zipf=1.1, genre_words=0.05, boost=4):
+    '''
+    List of 'num_songs' songs ({'name', 'lyrics', 'genre'}) as read by 'classify.get_lyrics_from_file'.
+    Words follow a Zipf distribution with exponent 'zipf'. For each genre a part ('genre_words')
+    of the words is 'boost' times more likely, so the genres can be told apart.
+    '''
+    rng = random.Random(seed)
+    words = make_vocabulary(rng, vocabulary_size)
+    base = [1 / rank**zipf for rank in range(1, vocabulary_size + 1)]
+    cum_weights = {}
+    for genre in genres:
+        favorite = set(rng.sample(range(vocabulary_size), int(genre_words * vocabulary_size)))
+        cum_weights[genre] = list(accumulate(weight * (boost if idx in favorite else 1) for idx, weight in enumerate(base)))
+
+    def line(genre):
+        text = ' '.join(rng.choices(words, cum_weights=cum_weights[genre], k=rng.randint(3, 10)))
+        return text.capitalize() if rng.random() < 0.5 else text
+
+    corpus = []
+    for idx in range(num_songs):
+        genre = genres[idx % len(genres)]
+        chorus = [line(genre) for _ in range(rng.randint(2, 4))]
+        lines = []
+        for section in sections:
+            if section in ['Intro', 'Bridge', 'Outro'] and rng.random() < 0.5:
+                continue
+            lines.append('[{}]'.format(section))
+            if section == 'Chorus':
+                lines.extend(chorus)
+            else:
+                lines.extend(line(genre) for _ in range(rng.randint(4, 8)))
+            lines.append('')
+        corpus.append({
+            'name': 'artist {}~song {}'.format(idx % 97, idx),
+            'lyrics': '\n'.join(lines),
+            'genre': genre,
+        })
+    rng.shuffle(corpus)
+    return corpus
+
+def config_name(backend, features, size):
+    return '{}|{}|{}'.format(backend, '+'.join(features) or 'baseline', size)
+
+def run_config(corpus, backend, features, extra, memory=False):
+    '''
+    Run the stages of 'Classy' once, returns (accuracy, profiling report)
+    '''
+    arguments = ['synthetic.json', '--backend', backend, '--token_cache', ''] + extra
+    if features:
+        arguments += ['--features'] + features
+    args = classify_args(arguments)
+    args.features = ['baseline'] + args.features
+
+    profiling.enable(memory)
+    try:
+        with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+            classy = Classy(list(corpus), args)
+            classy.split_train_test()
+            classy.train()
+            classy.test()
+        report = profiling.report()
+    finally:
+        profiling.disable()
+    return classy.accuracy, report
+
+def benchmark(args):
+    '''
+    Run all configurations, returns dict with the result of each
+    '''
+    configs = default_configs if not args.backend else [(backend, args.features) for backend in args.backend]
+    results = {}
+    for size in args.sizes:
+        t_start = time.time()
+        corpus = generate_corpus(size, args.seed)
+        print('Corpus: {} songs, {:.1f} seconds to generate'.format(size, time.time() - t_start))
+        for backend, features in configs:
+            name = config_name(backend, features, size)
+            print('  {}'.format(name), end='', flush=True)
+            result = {'stages': {}}
+            for _ in range(args.repeat):
+                accuracy, report = run_config(corpus, backend, features, args.classify)
+                for stage in stages:
+                    stats = report['stages'].get(stage)
+                    if stats is None:
+                        continue
+                    songs = stats['counters'].get('songs', 0)
+                    # Best of the repeats, the other runs were disturbed by something else
+                    if stage not in result['stages'] or stats['seconds'] < result['stages'][stage]['seconds']:
+                        result['stages'][stage] = {
+                            'seconds': stats['seconds'],
+                            'songs_per_second': songs / stats['seconds'] if songs and stats['seconds'] > 0 else None,
+                        }
+                result['rss_mb'] = report['rss_mb']
+            result['accuracy'] = accuracy
+            result['seconds'] = sum(stats['seconds'] for stats in result['stages'].values())
+
+            if args.memory:
+                # Separate run, tracing the memory slows down the stages
+                _, report = run_config(corpus, backend, features, args.classify, memory=True)
+                for stage, stats in result['stages'].items():
+                    stats['peak_mb'] = report['stages'][stage]['peak_mb']
+            print(', {:.2f} seconds, accuracy {:.2f}%'.format(result['seconds'], 100 * accuracy))
+            results[name] = result
+    return results
+
+def compare(results, baseline, tolerance, min_seconds=0.02):
+    '''
+    Print each stage next to the baseline, returns the list of regressions.
+    A stage is a regression if it is more than 'tolerance' (fraction) slower than the baseline,
+    and at least 'min_seconds' slower. Peak memory is compared the same way if in both.
+    '''
+    regressions = []
+    print('{:<36} {:<16} {:>10} {:>10} {:>8} {:>12} {:>10}'.format('Configuration', 'Stage', 'Seconds', 'Baseline', 'Ratio', 'Songs/s', 'Peak MB'))
+    for name, result in results.items():
+        old = baseline.get(name, {}) if baseline else {}
+        for stage, stats in result['stages'].items():
+            old_stats = old.get('stages', {}).get(stage)
+            ratio = stats['seconds'] / old_stats['seconds'] if old_stats and old_stats['seconds'] > 0 else None
+            print('{:<36} {:<16} {:>10.3f} {:>10} {:>8} {:>12} {:>10}'.format(
+                name, stage, stats['seconds'],
+                '{:.3f}'.format(old_stats['seconds']) if old_stats else '-',
+                '{:.2f}'.format(ratio) if ratio is not None else '-',
+                '{:.0f}'.format(stats['songs_per_second']) if stats['songs_per_second'] else '-',
+                '{:.1f}'.format(stats['peak_mb']) if 'peak_mb' in stats else '-'))
+            if ratio is not None and ratio > 1 + tolerance and stats['seconds'] - old_stats['seconds'] > min_seconds:
+                regressions.append('{} {}: {:.3f} seconds, baseline {:.3f}'.format(name, stage, stats['seconds'], old_stats['seconds']))
+            if old_stats and 'peak_mb' in stats and 'peak_mb' in old_stats and stats['peak_mb'] > (1 + tolerance) * old_stats['peak_mb']:
+                regressions.append('{} {}: peak {:.1f} MB, baseline {:.1f} MB'.format(name, stage, stats['peak_mb'], old_stats['peak_mb']))
+        if old and 'accuracy' in old and abs(result['accuracy'] - old['accuracy']) > 1e-9:
+            # Same corpus and settings, the result should not change
+            regressions.append('{}: accuracy {:.4f}%, baseline {:.4f}%'.format(name, 100 * result['accuracy'], 100 * old['accuracy']))
+    return regressions
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('--sizes', type=int, nargs='*', default=[500, 2000], help='Number of songs in the generated corpora')
+    parser.add_argument('--seed', type=int, default=1, help='Seed of the lyrics generator')
+    parser.add_argument('--repeat', type=int, default=3, help='Number of runs of each configuration, the fastest is kept')
+    parser.add_argument('--memory', action='store_true', help='Also measure the peak memory of each stage (one more run with tracemalloc)')
+    parser.add_argument('--backend', type=str, nargs='*', default=[], choices=['dict', 'sparse'], help='If provided, only run these backends with "--features", instead of the default configurations')
+    parser.add_argument('--features', type=str, nargs='*', default=[], help='Features used with "--backend"')
+    parser.add_argument('--classify', type=str, nargs=argparse.REMAINDER, default=[], help='Other arguments to "classify.py", must be last')
+
+    parser.add_argument('--baseline', type=str, default='benchmark-baseline.json', help='Baseline to compare with')
+    parser.add_argument('--save_baseline', action='store_true', help='Save the result as the new baseline')
+    parser.add_argument('--output', type=str, default='', help='If provided, save the result as json to this file')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='Fraction a stage can be slower than the baseline before it is a regression')
+
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    args = parse_args()
+
+    results = benchmark(args)
+    data = {
+        'date': time.strftime('%Y-%m-%d %H:%M'),
+        'python': platform.python_version(),
+        'machine': platform.node(),
+        'seed': args.seed,
+        'results': results,
+    }
+
+    baseline = None
+    if not args.save_baseline and os.path.exists(args.baseline):
+        baseline = json.load(open(args.baseline))
+        print()
+        print('Baseline from {} ({})'.format(baseline['date'], baseline['machine']))
+        if baseline['seed'] != args.seed:
+            print('Other seed than the baseline, the corpora are different')
+
+    print()
+    regressions = compare(results, baseline['results'] if baseline else None, args.tolerance)
+
+    for path in [args.output, args.baseline if args.save_baseline else '']:
+        if path:
+            with open(path, 'w') as f:
+                json.dump(data, f, indent=4, sort_keys=True)
+            print('Saved to: "{}"'.format(path))
+
+    if regressions:
+        print()
+        print('REGRESSIONS')
+        for regression in regressions:
+            print('  {}'.format(regression))
+        sys.exit(1)
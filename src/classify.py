@@ -6,13 +6,16 @@ From that data train a classifier and evaluate the performance
 
 import random
 import nltk
-import os
 import argparse
 from bayes import Classy
+from corpus import open_corpus
 import json
 from collections import Counter, OrderedDict
 from time import time
+import statistics
 import sys
+import cProfile
+import profiling
 
 # Available features.
 # The first element should be all, the second is the default
@@ -42,6 +45,9 @@ def parse_args(arguments=[]):
     parser.add_argument('-g', '--genres', nargs='*', default=['all'], help='Genres to be parsed',
         choices=['all', 'baseline', 'pop', 'rap', 'rock', 'country', 'electronic', 'rob'])
     parser.add_argument('-i', '--iterations', type=int, default=1, help='Number of iterations to run model')
+    parser.add_argument('--seed', type=int, default=12345, help='Seed for the random generator')
+    parser.add_argument('--sweep', type=int, nargs='*', default=[], help='If provided, unigram thresholds to evaluate with one trained model (sparse backend)')
+    parser.add_argument('--folds', type=int, default=0, help='If provided, run k-fold cross validation with this many folds instead of iterations')
 
     # N-grams
     parser.add_argument('-u', '--uni_thresh', type=int, default=2500, help='Number of unigram features to be in model')
@@ -50,15 +56,36 @@ def parse_args(arguments=[]):
     parser.add_argument('--four_thresh', type=int, default=1000, help='Number of four-gram features to be in model')
     parser.add_argument('--five_thresh', type=int, default=1000, help='Number of five-gram features to be in model')
 
+    parser.add_argument('--hash_bits', type=int, default=0, help='If provided, hash bigrams and up to 2**hash_bits buckets per order instead of storing the strings, for example 20. The counts take 48 * 2**hash_bits bytes (48 MB for 20, 3 GB for 26, the maximum)')
+
     parser.add_argument('-s', '--split', type=int, default=70, help='In percent, how much is training data')
     parser.add_argument('-f', '--features', type=str, nargs='*', default=[], help='Features to be used, default none.',
         choices=list(all_features.keys()))
 
+    parser.add_argument('--backend', type=str, default='dict', choices=['dict', 'sparse'],
+        help='Feature backend. "dict" uses nltk with one dict per song, "sparse" one sparse row per song')
+
+    parser.add_argument('--event_model', type=str, default='bernoulli', choices=['bernoulli', 'multinomial'],
+        help='Naive Bayes event model for the sparse backend')
+
+    parser.add_argument('-j', '--jobs', type=int, default=1, help='Number of processes used to extract features')
+
+    parser.add_argument('--token_cache', type=str, default='token-cache', help='Folder to cache tokenized lyrics in, empty to disable')
+    parser.add_argument('--cache_size', type=int, default=512, help='Maximum size of the token cache in MB')
+
+    parser.add_argument('--stem_cache', type=int, default=100000, help='Maximum number of words in the table of stemmed words')
+
+    parser.add_argument('--preprocess', action='store_true', help='Tokenize all songs once and reuse the result in all iterations')
+
+    parser.add_argument('--stream', action='store_true', help='Read the songs one chunk at a time instead of loading the corpus, for corpora which do not fit in memory (sparse backend)')
+    parser.add_argument('--chunk_size', type=int, default=1000, help='Number of songs in memory at the same time with --stream')
+
     parser.add_argument('--count', type=int, default=-1, help='Limit the number of songs in each genre to this number. To test system on smaller dataset.')
 
     parser.add_argument('--output', action='store_false', help='If provided, do not use multiline print')
     parser.add_argument('--stats', action='store_true', help='Show stats about precision, recall, f_measure')
     parser.add_argument('--folder_name', type=str, default='lyrics', help='Name of folder to look for songs')
+    parser.add_argument('--corpus', type=str, default='', help='Packed corpus file (from "corpus.py"), used instead of the folder')
     parser.add_argument('--show', type=int, default=-1, help='If provided, number of informative features to show')
 
     # Tune number of chars/words/unique words
@@ -66,43 +93,73 @@ def parse_args(arguments=[]):
     parser.add_argument('--num_words', type=int, default=-1, help='Number of words in lyrics')
     parser.add_argument('--num_unique', type=int, default=-1, help='Number of uique words in lyrics')
 
+    # Profiling
+    parser.add_argument('--profile', type=str, default='', help='If provided, time each stage and save the timings, memory and counters as json to this file')
+    parser.add_argument('--profile_memory', action='store_true', help='Also trace the peak memory of each stage with tracemalloc (slower), used with --profile')
+    parser.add_argument('--cprofile', type=str, default='', help='If provided, run with cProfile and save the stats to this file')
+
     args = parser.parse_args(arguments) if arguments else parser.parse_args()
 
+    # Counts and first positions of each order are stored in arrays with 2**hash_bits entries
+    if not 0 <= args.hash_bits <= 26:
+        parser.error('--hash_bits must be between 0 and 26')
+
+    if args.sweep and args.folds > 1:
+        parser.error('--sweep can not be used with --folds')
+
+    if args.stream:
+        if args.backend != 'sparse':
+            parser.error('--stream needs --backend sparse')
+        if args.sweep or args.folds > 1 or args.preprocess:
+            parser.error('--stream can not be used with --sweep, --folds or --preprocess')
+
     # Output is needed for the stats to work
     if args.stats:
         args.output = False
 
     return args
 
-def get_lyrics_from_file(args):
+def iter_lyrics_from_file(args, failed=None):
     '''
-    From specified 'args.file', return lyrics from 'args.folder_name'
+    Yields the songs of 'args.file' one at a time, lyrics from 'args.corpus' if given, else from 'args.folder_name'.
+    Songs without lyrics are added to 'failed' (list) if given.
     '''
+    genre_count = Counter()
+    lyrics_source = open_corpus(args.corpus, args.folder_name)
+    try:
+        for idx, entry in json.load(open(args.file)).items():
+            artist, song, genre = entry
 
-    corpus = []
-    genre_distribution = []
-    failed = []
-    for idx, entry in json.load(open(args.file)).items():
-        artist, song, genre = entry
-        song_path = os.path.join(args.folder_name, artist.replace('/','') + '~' + song.replace('/',''))
+            if ('all' not in args.genres) and (genre not in args.genres):
+                continue
 
-        if ('all' not in args.genres) and (genre not in args.genres):
-            continue
+            lyrics = lyrics_source.get(artist, song)
+            if lyrics is None:
+                if failed is not None:
+                    failed.append([artist, song])
+                continue
 
-        if not os.path.exists(song_path):
-            failed.append([artist, song])
-            continue
+            if args.count != -1:
+                if genre_count[genre] >= args.count:
+                    continue
 
-        if args.count != -1:
-            if genre_distribution.count(genre) >= args.count:
-                continue
-        genre_distribution.append(genre)
+            genre_count[genre] += 1
 
-        corpus.append({
-            'name': artist + '~' + song,
-            'lyrics': open(song_path).read(),
-            'genre': genre,
-        })
+            yield {
+                'name': artist + '~' + song,
+                'lyrics': lyrics,
+                'genre': genre,
+            }
+    finally:
+        lyrics_source.close()
+
+def get_lyrics_from_file(args):
+    '''
+    From specified 'args.file', return lyrics from 'args.corpus' if given, else from 'args.folder_name'
+    '''
+    failed = []
+    corpus = list(iter_lyrics_from_file(args, failed))
+    genre_distribution = [song['genre'] for song in corpus]
 
     return genre_distribution, corpus, failed
 
@@ -117,12 +174,13 @@ def run_model(i, corpus, args):
     print('===== RUNNING MODEL, iteration {}/{} ====='.format(i+1, args.iterations))
     random.shuffle(corpus)
 
-    classy = Classy(corpus, args)
+    with profiling.stage('iteration'):
+        classy = Classy(corpus, args)
 
-    classy.split_train_test()
+        classy.split_train_test()
 
-    classy.train()
-    classy.test()
+        classy.train()
+        classy.test()
 
     num_prints = classy.num_prints
 
@@ -141,6 +199,84 @@ def run_model(i, corpus, args):
 
     return classy.accuracy, classy.stats
 
+def run_stream(i, args):
+    '''
+    Run one iteration of the model without loading the corpus, see 'Classy.stream_train_test'.
+    The songs are split by a hash of their name, each iteration uses another split.
+    '''
+    t_run = time()
+
+    print('===== RUNNING MODEL, iteration {}/{} ====='.format(i+1, args.iterations))
+
+    with profiling.stage('iteration'):
+        classy = Classy([], args)
+
+        classy.stream_train_test(lambda: iter_lyrics_from_file(args), args.seed + i, args.chunk_size)
+
+        classy.train()
+        classy.test()
+
+    if args.output:
+        print('\033[F\033[K' * (classy.num_prints + 1), end='')
+        print(' {}: Accuracy: {:.2f}%, Train: {}, Test: {}, Time: {:.1f} seconds'.format(
+            str(i+1).rjust(2), 100*classy.accuracy, len(classy.train_set), len(classy.test_set), time() - t_run))
+
+    if args.show >= 1:
+        classy.show_features(args.show)
+
+    return classy.accuracy, classy.stats
+
+def run_sweep(i, corpus, args):
+    '''
+    Run one iteration of the model for all unigram thresholds in 'args.sweep'.
+    The model is trained once, with the largest threshold.
+    Returns dict with threshold -> accuracy.
+    '''
+    t_run = time()
+
+    print('===== RUNNING SWEEP, iteration {}/{} ====='.format(i+1, args.iterations))
+    random.shuffle(corpus)
+
+    with profiling.stage('sweep'):
+        classy = Classy(corpus, args)
+        sweep_accuracy = classy.sweep(args.sweep)
+
+    if args.output:
+        print('\033[F\033[K' * (classy.num_prints + 1), end='')
+        print(' {}: Time: {:.1f} seconds'.format(str(i+1).rjust(2), time() - t_run))
+        for threshold, accuracy in sorted(sweep_accuracy.items()):
+            print('     Unigrams: {:>6}, Accuracy: {:.2f}%'.format(threshold, 100*accuracy))
+
+    if args.show >= 1:
+        classy.show_features(args.show)
+
+    return sweep_accuracy
+
+def run_folds(corpus, args):
+    '''
+    Run k-fold cross validation, 'args.folds' folds.
+    The corpus is shuffled once and each song is tokenized once for all folds.
+    '''
+    t_run = time()
+
+    print('===== RUNNING MODEL, {} folds ====='.format(args.folds))
+    random.shuffle(corpus)
+
+    with profiling.stage('folds'):
+        classy = Classy(corpus, args)
+        accs, stats = classy.cross_validate(args.folds)
+
+    if args.output:
+        print('\033[F\033[K' * (classy.num_prints + 1), end='')
+    for i, acc in enumerate(accs):
+        print(' {}: Accuracy: {:.2f}%'.format(str(i+1).rjust(2), 100*acc))
+    print(' Time: {:.1f} seconds'.format(time() - t_run))
+
+    if args.show >= 1:
+        classy.show_features(args.show)
+
+    return accs, stats
+
 def _print(msg=''):
     '''
     Used when evaluating the system.
@@ -148,22 +284,57 @@ def _print(msg=''):
     '''
     print(msg) if not suppress_output else None
 
-def main(args, output=False):
+def load_corpus(args, corpus_cache=None):
+    '''
+    Read the lyrics with 'get_lyrics_from_file'.
+    If 'corpus_cache' (a dict) is given, the corpus is stored in it and reused by later calls with the
+    same file, genres and tokenize/stem settings. The songs are then preprocessed (tokenized) only once.
+    '''
+    if corpus_cache is None:
+        return get_lyrics_from_file(args)
+
+    args.preprocess = True
+    features = args.features
+    key = (args.file, args.folder_name, args.corpus, tuple(args.genres), args.count,
+        'tokenize' in features or 'all' in features, 'stem' in features or 'all' in features)
+    if key not in corpus_cache:
+        corpus_cache[key] = get_lyrics_from_file(args)
+    genre_distribution, corpus, failed = corpus_cache[key]
+    # Copy of the list, it is shuffled by the iterations
+    return list(genre_distribution), list(corpus), list(failed)
+
+def main(args, output=False, corpus_cache=None):
+    '''
+    Run the model with 'args'.
+    If 'output' is set, some prints are suppressed.
+    'corpus_cache' is used to share the preprocessed corpus between calls, see 'load_corpus'.
+    '''
     global suppress_output
     suppress_output = output
 
     try:
+        if args.profile:
+            profiling.enable(args.profile_memory)
+
         # Reset the seed after each test
-        random.seed(12345)
+        random.seed(args.seed)
 
         t_start = time()
         _print()
         _print('##### READING DATA #####')
         _print('Using file: "{}"'.format(args.file))
-        # Read lyrics for all songs in file
-        genre_distribution, corpus, failed = get_lyrics_from_file(args)
-        # Creates a dict of the genres and their song count
-        args.genres = Counter(genre_distribution)
+        if args.stream:
+            # The songs are read by each iteration
+            _print('Streaming songs, split by hash: {:.0f}:{:.0f}'.format(args.split, 100-args.split))
+            genre_distribution, corpus, failed = [], None, []
+        else:
+            # Read lyrics for all songs in file
+            with profiling.stage('read'):
+                genre_distribution, corpus, failed = load_corpus(args, corpus_cache)
+                profiling.count('songs', len(corpus))
+                profiling.count('failed', len(failed))
+            # Creates a dict of the genres and their song count
+            args.genres = Counter(genre_distribution)
 
         if failed:
             _print('Failed: {}'.format(len(failed)))
@@ -171,15 +342,19 @@ def main(args, output=False):
             if True:
                 for artist, song in failed:
                     _print(' "{}": "{}"'.format(artist, song))
-        _print()
-        _print('Number of songs in total: {}'.format(len(corpus)))
-        for genre, cntr in args.genres.items():
-            _print('  {}: "{}" '.format(cntr, genre))
-        num_train = int(args.split/100*len(corpus))
-
-        _print()
-        _print('##### MODEL PARAMETERS #####')
-        _print('Train and test: {:.0f}:{:.0f} ({}:{})'.format(args.split,100-args.split, num_train, len(corpus)-num_train))
+        if corpus is not None:
+            _print()
+            _print('Number of songs in total: {}'.format(len(corpus)))
+            for genre, cntr in args.genres.items():
+                _print('  {}: "{}" '.format(cntr, genre))
+            num_train = int(args.split/100*len(corpus))
+
+            _print()
+            _print('##### MODEL PARAMETERS #####')
+            _print('Train and test: {:.0f}:{:.0f} ({}:{})'.format(args.split,100-args.split, num_train, len(corpus)-num_train))
+        else:
+            _print()
+            _print('##### MODEL PARAMETERS #####')
 
         if 'all' in args.features:
             args.features = list(all_features.keys())[1:]
@@ -203,16 +378,42 @@ def main(args, output=False):
             _print('Classifier with four-gram value: {}'.format(args.four_thresh))
         if 'fivegram' in args.features:
             _print('Classifier with five-gram value: {}'.format(args.five_thresh))
-        _print('Number of iterations: {}'.format(args.iterations))
+        if args.folds > 1:
+            _print('Number of folds: {}'.format(args.folds))
+        else:
+            _print('Number of iterations: {}'.format(args.iterations))
 
-        # Run model 'args.iterations' times
         print()
-        accs = []
-        stats = []
-        for i in range(args.iterations):
-            acc, stat = run_model(i, corpus, args)
-            accs.append(acc)
-            stats.append(stat)
+        if args.sweep:
+            # Accuracy for each threshold, the best one is returned
+            sweeps = [run_sweep(i, corpus, args) for i in range(args.iterations)]
+            print()
+            print('##### SWEEP #####')
+            sweep_accuracy = {}
+            for threshold in sorted(args.sweep):
+                sweep_accuracy[threshold] = sum(sweep[threshold] for sweep in sweeps) / len(sweeps)
+                print('Unigrams: {:>6}, Average accuracy: {:.2f}%'.format(threshold, 100*sweep_accuracy[threshold]))
+            best = max(sweep_accuracy, key=sweep_accuracy.get)
+            print('Best threshold: {}'.format(best))
+            accs = [sweep[best] for sweep in sweeps]
+            stats = [sweep_accuracy]
+        elif args.folds > 1:
+            accs, stats = run_folds(corpus, args)
+        elif args.stream:
+            accs = []
+            stats = []
+            for i in range(args.iterations):
+                acc, stat = run_stream(i, args)
+                accs.append(acc)
+                stats.append(stat)
+        else:
+            # Run model 'args.iterations' times
+            accs = []
+            stats = []
+            for i in range(args.iterations):
+                acc, stat = run_model(i, corpus, args)
+                accs.append(acc)
+                stats.append(stat)
 
         total_accuracy = sum(accs) / len(accs)
         total_time = time() - t_start
@@ -220,10 +421,20 @@ def main(args, output=False):
         print()
         print('##### RESULT #####')
         print('Average accuracy: {:.2f}%'.format(100*total_accuracy))
+        if len(accs) > 1:
+            print('Standard deviation: {:.2f}%'.format(100*statistics.stdev(accs)))
 
         _print()
         print('Test time: {:.1f} seconds'.format(total_time))
 
+        if args.profile:
+            print()
+            print('##### PROFILE #####')
+            profiling.show()
+            profiling.dump(args.profile)
+            print('Saved to: "{}"'.format(args.profile))
+            profiling.disable()
+
         return total_accuracy, stats, total_time
 
     except KeyboardInterrupt:
@@ -244,4 +455,10 @@ def main(args, output=False):
         print('Error: {}'.format(e))
     '''
 if __name__ == '__main__':
-    main(parse_args())
\ No newline at end of file
+    args = parse_args()
+    if args.cprofile:
+        # Show with: python -m pstats <file>
+        cProfile.run('main(args)', args.cprofile)
+        print('cProfile stats saved to: "{}"'.format(args.cprofile))
+    else:
+        main(args)
\ No newline at end of file
@@ -0,0 +1,156 @@
+'''
+Packs all lyrics of a project file into one indexed binary file.
+Reading thousands of small files (one per song in the lyrics folder) is slow,
+especially on network file systems. The packed file is memory-mapped and each song
+can be read directly by its artist and song name.
+
+Layout of the file:
+    magic (4 bytes), version (uint32), length of index (uint64)
+    index: json list of [artist, song, genre, offset, length], offset -1 if lyrics are missing
+    data: all lyrics utf-8 encoded, offset is relative to the start of the data
+
+Pack a corpus:
+    python corpus.py billboard.json billboard.corpus --folder_name lyrics
+'''
+
+import argparse
+import json
+import mmap
+import os
+import struct
+import zlib
+from w8m8 import progressbar
+
+magic = b'CLSY'
+version = 1
+header = struct.Struct('<4sIQ')
+
+def song_file_name(artist, song):
+    '''
+    Name of the file with the lyrics in the lyrics folder
+    '''
+    return artist.replace('/', '') + '~' + song.replace('/', '')
+
+def pack_corpus(project_file, output_file, folder_name='lyrics'):
+    '''
+    Read all lyrics for the songs in 'project_file' from 'folder_name' and write them to 'output_file'.
+    Returns number of songs packed and number of songs without lyrics.
+    '''
+    data = json.load(open(project_file))
+    index = []
+    offset = 0
+    missing = 0
+    tmp_file = output_file + '.tmp'
+    with open(tmp_file, 'wb') as f:
+        # Data is written after the index, which is not known yet. Write to a separate file first.
+        with open(tmp_file + '.data', 'wb') as data_file:
+            for idx, (artist, song, genre) in enumerate(data.values()):
+                progressbar((idx+1)/len(data))
+                song_path = os.path.join(folder_name, song_file_name(artist, song))
+                if not os.path.exists(song_path):
+                    index.append([artist, song, genre, -1, 0])
+                    missing += 1
+                    continue
+                lyrics = open(song_path, 'rb').read()
+                data_file.write(lyrics)
+                index.append([artist, song, genre, offset, len(lyrics)])
+                offset += len(lyrics)
+        print()
+
+        index_bytes = json.dumps(index).encode('utf-8')
+        f.write(header.pack(magic, version, len(index_bytes)))
+        f.write(index_bytes)
+        with open(tmp_file + '.data', 'rb') as data_file:
+            while True:
+                chunk = data_file.read(2**20)
+                if not chunk:
+                    break
+                f.write(chunk)
+    os.remove(tmp_file + '.data')
+    os.replace(tmp_file, output_file)
+    return len(index) - missing, missing
+
+class PackedCorpus:
+    '''
+    Read only access to a packed corpus file
+    '''
+    def __init__(self, file_name):
+        self.file_name = file_name
+        self._file = open(file_name, 'rb')
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        file_magic, file_version, index_length = header.unpack_from(self._mmap, 0)
+        if file_magic != magic or file_version != version:
+            raise ValueError('Not a packed corpus file: "{}"'.format(file_name))
+        self.entries = json.loads(self._mmap[header.size:header.size + index_length].decode('utf-8'))
+        self._data_start = header.size + index_length
+        self._lookup = {(artist, song): idx for idx, (artist, song, genre, offset, length) in enumerate(self.entries)}
+
+    def __len__(self):
+        return len(self.entries)
+
+    def lyrics(self, idx):
+        '''
+        Lyrics of entry 'idx', None if missing
+        '''
+        artist, song, genre, offset, length = self.entries[idx]
+        if offset < 0:
+            return None
+        start = self._data_start + offset
+        return self._mmap[start:start + length].decode('utf-8')
+
+    def get(self, artist, song):
+        '''
+        Lyrics of 'song' by 'artist', None if missing
+        '''
+        idx = self._lookup.get((artist, song))
+        return None if idx is None else self.lyrics(idx)
+
+    def close(self):
+        self._mmap.close()
+        self._file.close()
+
+class LyricsFolder:
+    '''
+    Same interface as 'PackedCorpus' for the folder with one file per song
+    '''
+    def __init__(self, folder_name):
+        self.folder_name = folder_name
+
+    def get(self, artist, song):
+        song_path = os.path.join(self.folder_name, song_file_name(artist, song))
+        if not os.path.exists(song_path):
+            return None
+        return open(song_path).read()
+
+    def close(self):
+        pass
+
+def open_corpus(corpus_file='', folder_name='lyrics'):
+    '''
+    The packed corpus if 'corpus_file' is given, otherwise the lyrics folder
+    '''
+    return PackedCorpus(corpus_file) if corpus_file else LyricsFolder(folder_name)
+
+def in_train_set(name, percent, seed=0):
+    '''
+    Hash based train/test split, True if the song 'name' is in the train set.
+    About 'percent' (0-1) of the songs are in the train set. A song is always in the same set
+    for the same 'seed', so the split needs no shuffle and the songs can be read one at a time.
+    '''
+    return zlib.crc32('{}|{}'.format(seed, name).encode('utf-8')) < percent * 2**32
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('file', type=str, help='Name of json file')
+    parser.add_argument('output_file', type=str, help='Name of packed corpus file')
+    parser.add_argument('--folder_name', type=str, default='lyrics', help='Name of folder to look for songs')
+
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    args = parse_args()
+    print('Packing lyrics from "{}" in folder "{}"'.format(args.file, args.folder_name))
+    num_songs, missing = pack_corpus(args.file, args.output_file, args.folder_name)
+    print('Packed {} songs, {} without lyrics'.format(num_songs, missing))
+    print('Saved to: "{}"'.format(args.output_file))
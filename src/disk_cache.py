@@ -0,0 +1,118 @@
+'''
+Files stored on disk by key, with a maximum total size.
+Each entry is one file in a sub folder named by the first characters of the key.
+Reading an entry marks it as recently used (at most once per 'touch_interval'),
+the least recently used entries are removed first.
+One cache can be shared by the threads of a process, and by several processes.
+Used by the token cache and the http cache.
+'''
+
+import hashlib
+import os
+import threading
+import time
+
+def cache_key(*parts):
+    '''
+    Key of an entry from strings, as a hex digest
+    '''
+    return hashlib.sha1('\0'.join(parts).encode('utf-8')).hexdigest()
+
+class DiskCache:
+    def __init__(self, folder, max_size=512 * 2**20, touch_interval=3600):
+        '''
+        'folder': Where the entries are stored
+        'max_size': Maximum size of the cache in bytes
+        'touch_interval': Seconds before a read entry is marked as recently used again
+        '''
+        self.folder = folder
+        self.max_size = max_size
+        self.touch_interval = touch_interval
+        # Guards '_size' and the eviction
+        self.lock = threading.Lock()
+        self._size = None
+
+    def __getstate__(self):
+        # The lock can not be pickled, the worker processes get a new one
+        state = dict(self.__dict__)
+        del state['lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+
+    def path(self, key):
+        return os.path.join(self.folder, key[:2], key)
+
+    def read(self, key):
+        '''
+        Data of entry 'key', None if it is not in the cache
+        '''
+        path = self.path(key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+                mtime = os.fstat(f.fileno()).st_mtime
+            # Mark as recently used, the order of the eviction does not need to be more precise
+            if time.time() - mtime > self.touch_interval:
+                os.utime(path)
+            return data
+        except OSError:
+            return None
+
+    def store(self, key, data):
+        '''
+        Write entry atomically, several processes can use the same cache.
+        '''
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = '{}.{}.{}.tmp'.format(path, os.getpid(), threading.get_ident())
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+        with self.lock:
+            if self._size is None:
+                self._size = sum(size for _, _, size in self._entries())
+            else:
+                self._size += len(data)
+            if self._size > self.max_size:
+                self._evict()
+
+    def _entries(self):
+        '''
+        All entries as (last used, path, size)
+        '''
+        if not os.path.exists(self.folder):
+            return
+        for sub_folder in os.scandir(self.folder):
+            if not sub_folder.is_dir():
+                continue
+            for entry in os.scandir(sub_folder.path):
+                if entry.name.endswith('.tmp'):
+                    continue
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                yield stat.st_mtime, entry.path, stat.st_size
+
+    def evict(self):
+        '''
+        Remove the least recently used entries until the cache is below 90% of the maximum size.
+        '''
+        with self.lock:
+            self._evict()
+
+    def _evict(self):
+        entries = sorted(self._entries())
+        self._size = sum(size for _, _, size in entries)
+        for _, path, size in entries:
+            if self._size <= 0.9 * self.max_size:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            self._size -= size
@@ -0,0 +1,112 @@
+'''
+Download many pages at the same time.
+A pool of threads fetches the urls, each thread keeps its own 'requests.Session' so the
+connections to the server are reused (keep-alive) instead of opening one per page.
+Requests to each host are rate limited, failed requests are retried with exponential backoff.
+'''
+
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import urlsplit
+from requests.adapters import HTTPAdapter
+import http_cache
+import requests
+import threading
+import time
+
+# Status codes where the same request can succeed later
+retry_status = {429, 500, 502, 503, 504}
+
+class RateLimiter:
+    '''
+    At most 'rate' requests per second to each host, 0 for no limit
+    '''
+    def __init__(self, rate=0):
+        self.interval = 1 / rate if rate > 0 else 0
+        self.lock = threading.Lock()
+        self.next_time = {}
+
+    def wait(self, host):
+        if not self.interval:
+            return
+        with self.lock:
+            now = time.monotonic()
+            start = max(now, self.next_time.get(host, now))
+            self.next_time[host] = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+
+class Downloader:
+    def __init__(self, jobs=8, rate=0, retries=3, backoff=1, timeout=30, headers=None):
+        '''
+        'jobs': Number of pages downloaded at the same time
+        'rate': Maximum number of requests per second to each host, 0 for no limit
+        'retries': Number of times a failed request is tried again
+        'backoff': Seconds to wait before the first retry, doubled for each retry
+        'timeout': Seconds to wait for the server
+        'headers': Sent with every request
+        '''
+        self.jobs = jobs
+        self.limiter = RateLimiter(rate)
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.headers = headers or {}
+        self._local = threading.local()
+
+    def session(self):
+        '''
+        Session of the current thread
+        '''
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = self._local.session = requests.Session()
+            session.headers.update(self.headers)
+            session.mount('http://', HTTPAdapter(pool_connections=4, pool_maxsize=4))
+            session.mount('https://', HTTPAdapter(pool_connections=4, pool_maxsize=4))
+        return session
+
+    def get(self, url, params=None):
+        '''
+        Same as 'requests.get', with rate limit and retries, through the http cache if it is enabled.
+        Raises 'requests.RequestException' if the last try failed.
+        '''
+        host = urlsplit(url).netloc
+        def fetch(url, **kwargs):
+            # Pages from the http cache are not rate limited
+            self.limiter.wait(host)
+            return self.session().get(url, timeout=self.timeout, **kwargs)
+
+        for attempt in range(self.retries + 1):
+            delay = self.backoff * 2 ** attempt
+            try:
+                response = http_cache.get(url, params=params, fetch=fetch)
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt == self.retries:
+                    raise
+                time.sleep(delay)
+                continue
+
+            if response.status_code in retry_status and attempt < self.retries:
+                # The server can tell how long to wait
+                retry_after = response.headers.get('Retry-After', '')
+                time.sleep(float(retry_after) if retry_after.isdigit() else delay)
+                continue
+            response.raise_for_status()
+            return response
+
+    def map(self, function, items):
+        '''
+        Call 'function(item)' for all 'items' in the thread pool, 'function' should use 'get'.
+        Yields (item, result, error) in the order they are done, 'error' is None if it succeeded.
+        '''
+        executor = ThreadPoolExecutor(self.jobs)
+        try:
+            futures = {executor.submit(function, item): item for item in items}
+            for future in as_completed(futures):
+                try:
+                    yield futures[future], future.result(), None
+                except Exception as e:
+                    yield futures[future], None, e
+        finally:
+            # Stopped early (Ctrl-C), the pages not started are skipped
+            executor.shutdown(cancel_futures=True)
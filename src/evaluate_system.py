@@ -12,8 +12,11 @@ from time import strftime
 from copy import deepcopy
 import time
 import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import redirect_stdout
 import tests
 import datetime
+import profiling
 
 def _parse_args():
     parser = argparse.ArgumentParser()
@@ -22,9 +25,79 @@ def _parse_args():
     parser.add_argument('--result_file', type=str, default='result.json', help='Name of result json file')
     parser.add_argument('--folder_name', type=str, default='result', help='Name of folder to store result')
     parser.add_argument('--output', action='store_false', help='Suppress output from "classify.py"')
+    parser.add_argument('-w', '--workers', type=int, default=1, help='Number of tests to run at the same time')
+    parser.add_argument('--seed', type=int, default=12345, help='Seed for the random generator, set before each test')
+    parser.add_argument('--no_reuse', dest='reuse', action='store_false', help='Load and tokenize the corpus again for every test')
+    parser.add_argument('--resume', action='store_true', help='Skip tests already saved in the file with the current tests')
+    parser.add_argument('--token_cache', type=str, default='token-cache', help='Folder to cache tokenized lyrics in, shared by all tests')
+    parser.add_argument('--cache_size', type=int, default=512, help='Maximum size of the token cache in MB')
+    parser.add_argument('--profile', action='store_true', help='Time the stages of each test, saved to "profile.json" next to the result file')
+    parser.add_argument('--profile_memory', action='store_true', help='Also trace the peak memory of each stage with tracemalloc (slower)')
 
     return parser.parse_args()
 
+def dump_json(data, path):
+    '''
+    Write 'data' to 'path' atomically, a killed run never leaves a broken file
+    '''
+    tmp_path = '{}.tmp'.format(path)
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f, indent=4, sort_keys=True)
+    os.replace(tmp_path, path)
+
+# Preprocessed corpora, shared by all tests in the process (see 'classify.load_corpus')
+corpus_cache = {}
+
+def run_test(idx, arguments, output, quiet=False, reuse=True, profile=None):
+    '''
+    Run one test with 'classify.main'. Used directly or in a worker process.
+    If 'quiet', all output from the test is suppressed.
+    If 'reuse', the preprocessed corpus is shared with earlier tests in the same process.
+    If 'profile' is 'time' or 'memory', the stages are profiled and the report is returned, else None.
+    '''
+    cache = corpus_cache if reuse else None
+    if profile:
+        profiling.enable(profile == 'memory')
+    try:
+        if quiet:
+            with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+                f_accuracy, stats, elapsed = main(parse_args(arguments), True, cache)
+        else:
+            f_accuracy, stats, elapsed = main(parse_args(arguments), output, cache)
+        report = profiling.report()
+    finally:
+        profiling.disable()
+    return idx, f_accuracy, stats, elapsed, report
+
+def schedule_tests(pending, test_base, args):
+    '''
+    Run the 'pending' tests, list of (index, test).
+    With 'args.workers' > 1 the tests are run in a pool of processes and the results
+    are yielded in the order they finish. Each test seeds the random generator itself.
+    '''
+    cache_args = ['--token_cache', args.token_cache, '--cache_size', str(args.cache_size), '--seed', str(args.seed)]
+    profile = ('memory' if args.profile_memory else 'time') if args.profile else None
+    if args.workers <= 1:
+        for num, (idx, test) in enumerate(pending):
+            text_to_show = 'TEST NUMBER: {} / {}'.format(num+1, len(pending))
+            print()
+            print('########{}########'.format('#' * len(text_to_show)))
+            print('####    {}    ####'.format(text_to_show))
+            print('########{}########'.format('#' * len(text_to_show)))
+            print(test_base + test)
+            yield run_test(idx, test_base + test + cache_args, args.output, reuse=args.reuse, profile=profile)
+        return
+
+    print()
+    print('Running {} tests with {} workers'.format(len(pending), args.workers))
+    tests = dict(pending)
+    with ProcessPoolExecutor(args.workers) as executor:
+        futures = [executor.submit(run_test, idx, test_base + test + cache_args, args.output, True, args.reuse, profile) for idx, test in pending]
+        for num, future in enumerate(as_completed(futures)):
+            idx, f_accuracy, stats, elapsed, report = future.result()
+            print('Test {} / {} done: {} Accuracy: {:.2f}%'.format(num+1, len(pending), test_base + tests[idx], 100*f_accuracy))
+            yield idx, f_accuracy, stats, elapsed, report
+
 def run_tests(result_dict, tests, t_0, args):
     test_name, test_base, tests = tests[0], tests[1], tests[2:]
     output_name = '{}.json'.format(test_name.replace(' ', '-'))
@@ -36,7 +109,7 @@ def run_tests(result_dict, tests, t_0, args):
     print('Parameters are: \n {}'.format(test_base))
     for test in tests:
         print('   {}'.format(test))
-    result = []
+    result = {}
     diff = []
     current_result = {
         'best': {
@@ -46,18 +119,23 @@ def run_tests(result_dict, tests, t_0, args):
         }
     }
 
-    # File with just the current tests, overwrite old file
-    json.dump(current_result, open(output_path, 'w'), indent=4, sort_keys=True)
-    for idx, test in enumerate(tests):
-        text_to_show = 'TEST NUMBER: {} / {}'.format(idx+1, len(tests))
+    # Continue a killed run, tests in the file with the current tests are already done
+    if args.resume and os.path.exists(output_path):
+        current_result = json.load(open(output_path))
+        for idx, test in enumerate(tests):
+            key = '|'.join(test_base + test)
+            if key in current_result:
+                done = current_result[key]
+                result[idx] = [float(done['accuracy'][-1]) / 100, float(done['elapsed'][-1]), test]
         print()
-        print('########{}########'.format('#' * len(text_to_show)))
-        print('####    {}    ####'.format(text_to_show))
-        print('########{}########'.format('#' * len(text_to_show)))
-        print(test_base + test)
-        f_accuracy, stats, elapsed = main(parse_args(test_base + test), args.output)
+        print('Resuming, {} tests already done'.format(len(result)))
 
-        result.append([f_accuracy, elapsed, test])
+    # File with just the current tests, overwrite old file
+    dump_json(current_result, output_path)
+    pending = [(idx, test) for idx, test in enumerate(tests) if idx not in result]
+    for idx, f_accuracy, stats, elapsed, report in schedule_tests(pending, test_base, args):
+        test = tests[idx]
+        result[idx] = [f_accuracy, elapsed, test]
 
         key = '|'.join(test_base + test)
 
@@ -108,21 +186,33 @@ def run_tests(result_dict, tests, t_0, args):
         if len(set(accs)) > 1:
             diff.append([key, accs])
             print('Different result.')
-            for idx, acc in enumerate(accs):
-                print(' {}: Acc: {}'.format(idx, acc))
+            for acc_idx, acc in enumerate(accs):
+                print(' {}: Acc: {}'.format(acc_idx, acc))
 
         # Dump data after each run
         # Big file with all results
-        json.dump(result_dict, open(args.result_path, 'w'), indent=4, sort_keys=True)
+        dump_json(result_dict, args.result_path)
 
         # File with just the current tests, overwrite old file
-        json.dump(current_result, open(output_path, 'w'), indent=4, sort_keys=True)
+        dump_json(current_result, output_path)
+
+        # Profile of the latest run of each test, next to the big file
+        if report is not None:
+            profile_dict = json.load(open(args.profile_path)) if os.path.exists(args.profile_path) else {}
+            profile_dict[key] = {
+                'name': test_name,
+                'full': test_base + test,
+                'date': date,
+                'clock': clock,
+                'profile': report,
+            }
+            dump_json(profile_dict, args.profile_path)
 
         print()
         print('Total time: {:.1f} seconds'.format(time.time()-t_0))
 
 
-    return result, diff
+    return [result[idx] for idx in sorted(result)], diff
 
 def show_result(result, tests):
     best = (result[0][0], result[0][2])
@@ -154,6 +244,7 @@ if __name__ == '__main__':
             os.makedirs(args.folder_name)
 
         args.result_path = os.path.join(args.folder_name, args.result_file)
+        args.profile_path = os.path.join(args.folder_name, 'profile.json')
         print('Total number of big tests: {}'.format(len(args.test)))
         for idx, test_name in enumerate(args.test):
             big_text_to_show = 'BIG TEST: {} / {}'.format(idx+1, len(args.test))
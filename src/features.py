@@ -0,0 +1,257 @@
+'''
+Sparse feature backend for the classifier.
+Each selected n-gram is given an integer column once, when the n-grams are chosen in
+'Classy.split_train_test'. A song is then stored as one row of a CSR matrix with the
+columns it contains, instead of a dict with one formatted key for every selected n-gram.
+
+With feature hashing ('hash_ngrams') the n-grams of order 2 and up are buckets in a
+fixed range instead of strings, so the memory does not grow with the vocabulary.
+'''
+
+from array import array
+from collections import Counter
+import numpy as np
+import re
+import zlib
+
+# Same as 'nltk.wordpunct_tokenize'
+wordpunct_pattern = re.compile(r'\w+|[^\w\s]+')
+
+# Constants of the n-gram hash, see 'hash_ngrams'
+hash_multiplier = np.uint64(0x9E3779B97F4A7C15)
+hash_step = np.uint64(0x100000001B3)
+
+def hash_ngrams(lines, max_order=5, bits=20):
+    '''
+    Hashed n-grams of order 2 to 'max_order' for the words in 'lines' (list of the words of each line,
+    split on space). Same n-grams as the joined strings in 'lyrics_grams', but each n-gram is
+    a bucket in [0, 2**bits) computed from the ids of the words, no strings are created.
+    Returns a list with one Counter of buckets per order, in the order the buckets first occur.
+    '''
+    words = [word for line in lines for word in line]
+    if not words:
+        return [Counter() for order in range(2, max_order + 1)]
+    # Stable id of each word (not 'hash', which differs between processes)
+    ids = np.fromiter((zlib.crc32(word.encode('utf-8')) for word in words), dtype=np.uint64, count=len(words))
+    position = np.concatenate([np.arange(len(line)) for line in lines])
+    non_empty = np.fromiter((len(word.rstrip()) > 0 for word in words), dtype=bool, count=len(words))
+
+    result = []
+    # Rolling hash, 'window[j]' is the hash of the n-gram which starts at word j
+    window = ids
+    shift = np.uint64(64 - bits)
+    for order in range(2, max_order + 1):
+        window = window[:-1] * hash_step + ids[order-1:]
+        # The n-gram ends at word 'order - 1 + j', which must be in the same line and not empty
+        end = np.arange(order - 1, len(words))
+        valid = (position[end] >= order - 1) & non_empty[end]
+        buckets = ((window[valid] ^ np.uint64(order)) * hash_multiplier) >> shift
+        values, first, counts = np.unique(buckets, return_index=True, return_counts=True)
+        # Same order as the Counter of strings, ties in the ranking depend on it
+        first_order = np.argsort(first)
+        result.append(Counter(dict(zip(values[first_order].tolist(), counts[first_order].tolist()))))
+    return result
+
+def lyrics_grams(lyrics, n_grams=True, hash_bits=0):
+    '''
+    Split the lyrics in words and n-grams. Metadata lines ('[Chorus]' etc) are kept separate.
+    Returns the list of words, a Counter for each of bi-, tri-, four- and five-grams,
+    the metadata (lowercase, without brackets) and the lines without metadata.
+    Bigrams and up are only extracted if 'n_grams' is set.
+    If 'hash_bits' is given, the n-grams are hashed, see 'hash_ngrams'.
+    '''
+    uni_grams = []
+    bi_grams = Counter()
+    tri_grams = Counter()
+    four_grams = Counter()
+    five_grams = Counter()
+    meta_data = []
+    no_meta_lines = []
+    lines = []
+    for line in lyrics.split('\n'):
+        line = line.rstrip()
+        if len(line) <= 1:
+            continue
+        if line[0] + line[-1] == '[]':
+            meta_data.append(line[1:-1].lower())
+            continue
+        no_meta_lines.append(line)
+        words = line.split(' ')
+        if hash_bits:
+            lines.append(words)
+        for idx, word in enumerate(words):
+            word = word.rstrip()
+            # Ignore double space
+            if len(word) > 0:
+                uni_grams.append(word)
+                # Speed up by not checking further
+                if not n_grams or hash_bits:
+                    continue
+                if idx >= 1:
+                    bi_grams['|'.join(words[idx-1:idx+1])] += 1
+                if idx >= 2:
+                    tri_grams['|'.join(words[idx-2:idx+1])] += 1
+                if idx >= 3:
+                    four_grams['|'.join(words[idx-3:idx+1])] += 1
+                if idx >= 4:
+                    five_grams['|'.join(words[idx-4:idx+1])] += 1
+
+    if n_grams and hash_bits:
+        bi_grams, tri_grams, four_grams, five_grams = hash_ngrams(lines, 5, hash_bits)
+
+    return uni_grams, bi_grams, tri_grams, four_grams, five_grams, meta_data, no_meta_lines
+
+def meta_counts(meta_data):
+    '''
+    Number of each type of metadata in a song, used to keep track of how the song is structured
+    '''
+    meta_members = {
+        'verse': 0, 'chorus': 0, 'intro': 0, 'outro': 0,
+        'break':0, 'bridge': 0, 'skit': 0, 'hook': 0,
+        'drop': 0, 'interlude': 0, 'breakdown': 0,
+        'pre-chorus': 0,
+        }
+
+    for item in meta_data:
+        if 'refrain' in item:
+            item = 'chorus'
+        for key in meta_members.keys():
+            if key in item:
+                meta_members[key] += 1
+    return meta_members
+
+def lyrics_sizes(lyrics):
+    '''
+    Number of characters, words and unique words in the lyrics
+    '''
+    tokenized_lyrics = wordpunct_pattern.findall(lyrics)
+    return {
+        'chars': len(lyrics),
+        'words': len(tokenized_lyrics),
+        'unique': len(set(tokenized_lyrics)),
+    }
+
+class FeatureSpace:
+    '''
+    The columns of all binary features.
+    Columns are grouped by prefix ('uni', 'bi', ...) so a song only needs to look up
+    the n-grams it actually contains.
+    '''
+    def __init__(self):
+        self.columns = {}
+        self.names = []
+
+    def __len__(self):
+        return len(self.names)
+
+    def add(self, prefix, grams, sort=True):
+        '''
+        Give every gram in 'grams' a column. Sorted to make the columns deterministic,
+        if 'sort' is False the columns are in the order of 'grams'.
+        '''
+        columns = self.columns.setdefault(prefix, {})
+        for gram in (sorted(grams) if sort else grams):
+            if gram in columns:
+                continue
+            columns[gram] = len(self.names)
+            self.names.append('{}({})'.format(prefix, gram))
+
+    def row(self, grams):
+        '''
+        From 'grams', a dict with prefix -> Counter of the grams in a song,
+        return a dict with column -> count for the selected grams.
+        '''
+        row = {}
+        for prefix, counter in grams.items():
+            columns = self.columns.get(prefix)
+            if not columns:
+                continue
+            # Loop over the smallest of the two
+            if len(counter) < len(columns):
+                for gram, cnt in counter.items():
+                    if gram in columns:
+                        row[columns[gram]] = cnt
+            else:
+                for gram, column in columns.items():
+                    if gram in counter:
+                        row[column] = counter[gram]
+        return row
+
+class SparseMatrix:
+    '''
+    Compressed sparse row matrix of counts.
+    Rows are appended one at a time and stored in compact arrays.
+    '''
+    def __init__(self, num_columns):
+        self.num_columns = num_columns
+        self.indptr = array('q', [0])
+        self.indices = array('i')
+        self.data = array('i')
+
+    def __len__(self):
+        return len(self.indptr) - 1
+
+    def append(self, row):
+        '''
+        Add a row, 'row' is a dict with column -> count
+        '''
+        for column in sorted(row):
+            self.indices.append(column)
+            self.data.append(row[column])
+        self.indptr.append(len(self.indices))
+
+    def row(self, idx):
+        '''
+        Columns and counts of row 'idx'
+        '''
+        start, stop = self.indptr[idx], self.indptr[idx+1]
+        return self.indices[start:stop], self.data[start:stop]
+
+    def row_ids(self):
+        '''
+        Row number for every stored entry, same length as 'indices'
+        '''
+        return np.repeat(np.arange(len(self)), np.diff(np.frombuffer(self.indptr, dtype=np.int64)))
+
+    def dense(self, start=0, stop=None, binary=True):
+        '''
+        Rows 'start':'stop' as a dense matrix.
+        If 'binary' is set, the entries are 1 if the column is present in the row.
+        '''
+        stop = len(self) if stop is None else min(stop, len(self))
+        out = np.zeros((stop - start, self.num_columns), dtype=np.float64)
+        lo, hi = self.indptr[start], self.indptr[stop]
+        if hi > lo:
+            indptr = np.frombuffer(self.indptr, dtype=np.int64)[start:stop+1] - lo
+            rows = np.repeat(np.arange(stop - start), np.diff(indptr))
+            columns = np.frombuffer(self.indices, dtype=np.int32)[lo:hi]
+            out[rows, columns] = 1 if binary else np.frombuffer(self.data, dtype=np.int32)[lo:hi]
+        return out
+
+class SparseSet:
+    '''
+    Features for a set of songs.
+    'rows' are the binary features (n-grams and flags) as a sparse matrix,
+    'meta' are the counts of the song structure (verse, chorus, ...),
+    'genres' the correct genre for each song.
+    '''
+    def __init__(self, num_columns, meta_names=None):
+        self.rows = SparseMatrix(num_columns)
+        self.meta_names = meta_names or []
+        self.meta = []
+        self.genres = []
+
+    def __len__(self):
+        return len(self.genres)
+
+    def append(self, row, meta, genre):
+        self.rows.append(row)
+        if self.meta_names:
+            self.meta.append([meta[name] for name in self.meta_names])
+        self.genres.append(genre)
+
+    def meta_matrix(self):
+        '''
+        The meta counts as an integer matrix with one column per name in 'meta_names'
+        '''
+        return np.array(self.meta, dtype=np.int64).reshape(len(self), len(self.meta_names))
@@ -5,13 +5,15 @@ From that file find all songs and store the lyrics
 
 from genius import *
 from scraper import *
+from downloader import Downloader
+import http_cache
+from matching import remove_featuring
 
 import sys
 from w8m8 import progressbar
 import argparse
 import json
 import os
-from bs4 import BeautifulSoup
 
 json_db_file = 'billboard-links2.json'
 
@@ -36,7 +38,21 @@ def parse_args():
 
     parser.add_argument('--lev', type=int, default=0, help='Use levenstein distance when finding lyrics (ignores small spelling error)')
 
-    return parser.parse_args()
+    parser.add_argument('-j', '--jobs', type=int, default=8, help='Number of lyrics downloaded at the same time')
+    parser.add_argument('--rate', type=float, default=5, help='Maximum number of requests per second to each host, 0 for no limit')
+    parser.add_argument('--retries', type=int, default=3, help='Number of times a failed download is tried again')
+    parser.add_argument('--checkpoint', type=int, default=100, help='Save the url db after this number of searched songs')
+    parser.add_argument('--api_url', type=str, default=base_url, help='Url of the genius API')
+
+    parser.add_argument('--http_cache', type=str, default='http-cache', help='Folder to cache downloaded pages in, empty to not cache')
+    parser.add_argument('--cache_size', type=int, default=1024, help='Maximum size of the http cache in MB')
+    parser.add_argument('--cache_ttl', type=float, default=7*24, help='Hours before a cached page is checked with the server again')
+    parser.add_argument('--offline', action='store_true', help='Only use pages in the http cache, never the network')
+
+    args = parser.parse_args()
+    if args.checkpoint < 1:
+        parser.error('--checkpoint must be at least 1')
+    return args
 
 def get_lyrics_from_url():
     '''
@@ -48,14 +64,10 @@ def get_lyrics_from_url():
     print('File: {} with: {} songs'.format(args.db_file, num_songs))
     print()
     print()
-    cntr = 0
     failed = []
+    pending = []
     for key, url in data.items():
         artist, song = eval(key)
-        cntr += 1
-        progressbar(cntr/num_songs, '"{}"'.format(artist), '"{}"'.format(song))
-        print('\033[F {} found, {} failed, '.format(cntr - len(failed), len(failed)))
-
         song_path = os.path.join(args.folder_name, artist.replace('/','') + '~' + song.replace('/',''))
         # File already processed
         if os.path.exists(song_path):
@@ -65,10 +77,26 @@ def get_lyrics_from_url():
         if url in ['', 'fail', 'manual', 'none']:
             failed.append([url, key])
             continue
+        pending.append((key, url, song_path))
+    print('\033[F {} already downloaded, {} without url, {} to download'.format(num_songs - len(pending) - len(failed), len(failed), len(pending)))
+
+    downloader = Downloader(args.jobs, args.rate, args.retries)
+    def download(item):
+        key, url, song_path = item
+        return get_lyrics_page(downloader.get(url).text)
 
-        lyrics = get_lyrics_url(url)
-        with open(song_path, 'w') as f:
-            f.write(lyrics)
+    cntr = 0
+    num_failed = len(failed)
+    for (key, url, song_path), lyrics, error in downloader.map(download, pending):
+        cntr += 1
+        if error is not None:
+            failed.append([str(error), key])
+        else:
+            # Written to a temporary file first, an interrupted run never leaves half a song
+            with open(song_path + '.tmp', 'w') as f:
+                f.write(lyrics)
+            os.replace(song_path + '.tmp', song_path)
+        progressbar(cntr/len(pending), '{} downloaded, {} failed'.format(cntr - len(failed) + num_failed, len(failed) - num_failed))
 
     print()
     for i, (code, name) in enumerate(failed):
@@ -78,53 +106,82 @@ def get_lyrics_from_url():
             break
     print('Number of failed: {}'.format(len(failed)))
 
+def dump_db(data):
+    '''
+    Write the url db atomically, a crash while writing never leaves a broken file
+    '''
+    with open(args.db_file + '.tmp', 'w') as f:
+        json.dump(data, f, indent=4)
+    os.replace(args.db_file + '.tmp', args.db_file)
+
 def find_url_for_songs():
     '''
     Use the genius API to find urls for the songs in "db_file"
+    The searches are done in parallel, the db is saved every "checkpoint" songs.
+    Songs where the user has to choose (with "fix_failed") are asked for after all searches.
     '''
-    fix_failed = 'fix_failed' if args.fix_failed else ''
-
     with open(args.db_file) as f:
         data = json.load(f)
     num_songs = len(data)
     print('File: {} with: {} songs'.format(args.db_file, num_songs))
     print()
     print()
-    cntr = 0
     failed = []
+    pending = []
+    for key, url in data.items():
+        artist, song = eval(key)
+        if (url in ['manual', 'none']) or (url == 'fail' and not args.fix_failed):
+            failed.append([artist, song])
+            continue
+
+        if 'genius.com' in url:
+            continue
+        pending.append((key, artist, song))
+    print('\033[F {} songs to search, {} failed before'.format(len(pending), len(failed)))
+
+    downloader = Downloader(args.jobs, args.rate, args.retries, headers=headers)
+    def search(item):
+        key, artist, song = item
+        if args.ignore_feat:
+            artist = remove_featuring(artist)
+        response = downloader.get(args.api_url + '/search', params=search_query(artist, song))
+        return match_song(artist, song, response.json()['response']['hits'], args.lev, verbose=False)
 
+    cntr = 0
+    num_failed = len(failed)
+    ask = []
     try:
-        for key, url in data.items():
-            artist, song = eval(key)
+        for (key, artist, song), result, error in downloader.map(search, pending):
             cntr += 1
-            print('\033[F {} found, {} failed, '.format(cntr - len(failed), len(failed)))
-            progressbar(cntr/num_songs, '"{}"'.format(artist), '"{}"'.format(song))
-            if (url in ['manual', 'none']) or (url == 'fail' and not args.fix_failed):
+            if error is not None:
+                # Url is not changed, the song is searched again next time
                 failed.append([artist, song])
-                continue
-
-            if 'genius.com' in url:
-                continue
+            else:
+                match, alternatives = result
+                if match is not None:
+                    data[key] = match[0]
+                else:
+                    data[key] = 'fail'
+                    if args.fix_failed:
+                        ask.append((key, artist, song, alternatives))
+                    else:
+                        failed.append([artist, song])
+
+                if cntr % args.checkpoint == 0:
+                    dump_db(data)
+            progressbar(cntr/len(pending), '{} found, {} failed'.format(cntr - len(failed) + num_failed - len(ask), len(failed) - num_failed))
+        dump_db(data)
+        print()
 
+        # Songs without a match, the user chooses from the alternatives
+        for key, artist, song, alternatives in ask:
             if args.ignore_feat:
-                if ' Featuring' in artist:
-                    featuring = artist.index(' Featuring')
-                    artist_no_feature = artist[:featuring]
-                elif ' With' in artist:
-                    featuring = artist.index(' With')
-                    artist_no_feature = artist[:featuring]
-                elif ' &' in artist:
-                    featuring = artist.index(' &')
-                    artist_no_feature = artist[:featuring]
-                else:
-                    artist_no_feature = artist
-                url, q_artist, q_song = get_url_from_name(artist_no_feature, song, fix_failed, args.lev)
-            else:
-                url, q_artist, q_song = get_url_from_name(artist, song, fix_failed, args.lev)
+                artist = remove_featuring(artist)
+            url, q_artist, q_song = ask_user(artist, song, alternatives)
+            data[key] = url
             if url in ['fail', 'manual']:
                 failed.append([artist, song])
-
-            data[key] = url
+            dump_db(data)
     except KeyboardInterrupt:
         pass
     except Exception as e:
@@ -132,8 +189,7 @@ def find_url_for_songs():
         pass
 
     # Dump data
-    with open(args.db_file, 'w') as f:
-        json.dump(data, f, indent=4)
+    dump_db(data)
 
     print()
     for i, fail in enumerate(failed):
@@ -146,6 +202,12 @@ def find_url_for_songs():
 if __name__ == '__main__':
     args = parse_args()
 
+    if args.http_cache:
+        http_cache.enable(args.http_cache, args.cache_size * 2**20, args.cache_ttl * 3600, args.offline)
+    elif args.offline:
+        print('--offline needs --http_cache')
+        sys.exit(1)
+
     if not os.path.exists(args.folder_name):
         os.makedirs(args.folder_name)
 
@@ -2,10 +2,10 @@
 Get data from genius by using genius API as well as normal scraping, genius have no API method to get lyrics :(
 '''
 
-import requests
-from bs4 import BeautifulSoup
+import http_cache
+from html_extract import lyrics_text
 from api_token import token
-from pylev3 import Levenshtein
+from matching import first_match
 
 base_url = "http://api.genius.com"
 search_url = base_url + "/search"
@@ -19,40 +19,79 @@ def get_lyrics_url(url):
     From the url, extract the lyrics
     Based on code from: https://bigishdata.com/2016/09/27/getting-song-lyrics-from-geniuss-api-scraping/
     '''
-    page = requests.get(url)
-    html = BeautifulSoup(page.text, "html.parser")
-    #remove script tags that they put in the middle of the lyrics
-    [h.extract() for h in html('script')]
-    #at least Genius is nice and has a tag called 'lyrics'!
-    lyrics = html.find("div", class_="lyrics").get_text() #updated css where the lyrics are based in HTML
+    page = http_cache.get(url)
+    return get_lyrics_page(page.text)
+
+def get_lyrics_page(text):
+    '''
+    Extract the lyrics from the html of a genius song page
+    '''
+    lyrics = lyrics_text(text)
+    if lyrics is None:
+        raise ValueError('No lyrics found on page')
     return lyrics
 
-def levenshtein_distance(first, second):
+def search_query(artist, song):
     '''
-    Find the Levenshtein distance between two strings.
-    Taken from:
-    https://www.stavros.io/posts/finding-the-levenshtein-distance-in-python/
+    Parameters of the genius search for a song
+    '''
+    return {'q': artist + ' ' + song}
+
+def match_song(artist, song, hits, lev=0, verbose=True):
     '''
-    if len(first) > len(second):
-        first, second = second, first
-    if len(second) == 0:
-        return len(first)
-    first_length = len(first) + 1
-    second_length = len(second) + 1
-    distance_matrix = [[0] * second_length for x in range(first_length)]
-    for i in range(first_length):
-        distance_matrix[i][0] = i
-        for j in range(second_length):
-            distance_matrix[0][j]=j
-    for i in range(1, first_length):
-        for j in range(1, second_length):
-            deletion = distance_matrix[i-1][j] + 1
-            insertion = distance_matrix[i][j-1] + 1
-            substitution = distance_matrix[i-1][j-1]
-            if first[i-1] != second[j-1]:
-                substitution += 1
-            distance_matrix[i][j] = min(insertion, deletion, substitution)
-    return distance_matrix[first_length-1][second_length-1]
+    Find the song in the 'hits' of a genius search.
+    Returns (url, artist, song) of the match (None if no match) and the other hits as alternatives.
+    If 'verbose', matches by Levenshtein distance are printed.
+    '''
+    candidates = []
+    for hit in hits:
+        result = hit['result']
+        q_artist = result['primary_artist']['name'].replace(u'\u200b', '')
+        q_song = result['title'].replace(u'\u200b', '')
+        candidates.append([result['url'], q_artist, q_song])
+
+    # Exact match or Levenschtein distance <= 'lev', first hit is used
+    idx, distance = first_match(artist, song, [candidate[1:] for candidate in candidates], lev)
+    if idx is None:
+        return None, candidates
+
+    url, q_artist, q_song = candidates[idx]
+    if verbose and distance > 0:
+        print(artist, '|', song)
+        print(q_artist, '|', q_song)
+        print('Total levenstein distance: {} / {}. Considered valid'.format(distance, lev))
+        print()
+    return (url, q_artist, q_song), candidates[:idx]
+
+def ask_user(artist, song, alternatives):
+    '''
+    Gives examples to the user, answer with number of correct or blank if no match
+    '''
+    print()
+    print()
+    for i, (url, q_artist, q_song) in enumerate(alternatives):
+        print('"{}": "{}" \n\t"{}"'.format(i, q_artist, q_song))
+
+    res = input('Enter number for correct, "n" for failed: ')
+    print()
+    if res.isdigit():
+        try:
+            with open(matching_file_name, 'a+') as f:
+                f.write('Json:["{}" "{}"] ::matched:: genius: "{}"\n'.format(artist, song, str(alternatives[int(res)][1:])))
+            print('Valid entry: {}'.format(str(alternatives[int(res)][1:])))
+            print()
+            print()
+            return(alternatives[int(res)])
+        except:
+            print('Not valid number: {}'.format(int(res)))
+            print()
+            print()
+            return 'manual', '', ''
+
+    print('Failed song')
+    print()
+    print()
+    return 'manual', '', ''
 
 def get_url_from_name(artist, song, verbose='', lev=0):
     '''
@@ -60,10 +99,10 @@ def get_url_from_name(artist, song, verbose='', lev=0):
     If verbose is set to 'fix_failed', method is called again and queries the user about alternatives.
     '''
 
-    query = {'q': artist + ' ' + song}
+    query = search_query(artist, song)
 
     try:
-        response = requests.get(search_url, params=query, headers=headers)
+        response = http_cache.get(search_url, params=query, headers=headers)
     except KeyboardInterrupt:
         pass
     except:
@@ -71,60 +110,13 @@ def get_url_from_name(artist, song, verbose='', lev=0):
         print(search_url)
         input('Enter to continue')
 
-    alternatives = []
-    # Returns a number of hits, try to find correct one
-    for hit in response.json()['response']['hits']:
-        result = hit['result']
-
-        url = result['url']
-        q_artist = result['primary_artist']['name'].replace(u'\u200b', '')
-        q_song = result['title'].replace(u'\u200b', '')
-        q_api_path = result["api_path"]
-
-        if q_artist.lower() == artist.lower():
-            if q_song.lower() == song.lower():
-                return url, q_artist, q_song
-
-        # Levenschtein calculations. If distance <= 'lev' it is accepted
-        lev_artist = levenshtein_distance(q_artist.lower(), artist.lower())
-        lev_song = levenshtein_distance(q_song.lower(), song.lower())
-
-        if (lev_artist + lev_song) <= lev:
-            print(artist, '|', song)
-            print(q_artist, '|', q_song)
-            print('Total levenstein distance: {} / {}. Considered valid'.format(lev_artist + lev_song, lev))
-            print()
-            return url, q_artist, q_song
-
-        alternatives.append([url, q_artist, q_song])
+    match, alternatives = match_song(artist, song, response.json()['response']['hits'], lev)
+    if match is not None:
+        return match
 
     # Gives examples to the user, answer with number of correct or blank if no match
     if verbose == 'ask_user':
-        print()
-        print()
-        for i, (url, q_artist, q_song) in enumerate(alternatives):
-            print('"{}": "{}" \n\t"{}"'.format(i, q_artist, q_song))
-
-        res = input('Enter number for correct, "n" for failed: ')
-        print()
-        if res.isdigit():
-            try:
-                with open(matching_file_name, 'a+') as f:
-                    f.write('Json:["{}" "{}"] ::matched:: genius: "{}"\n'.format(artist, song, str(alternatives[int(res)][1:])))
-                print('Valid entry: {}'.format(str(alternatives[int(res)][1:])))
-                print()
-                print()
-                return(alternatives[int(res)])
-            except:
-                print('Not valid number: {}'.format(int(res)))
-                print()
-                print()
-                return 'manual', '', ''
-
-        print('Failed song')
-        print()
-        print()
-        return 'manual', '', ''
+        return ask_user(artist, song, alternatives)
 
     # No match, if verbose is "fix_failed", call method again and query user with alternatives
     elif verbose == 'fix_failed':
@@ -0,0 +1,227 @@
+'''
+Extract the chart items of billboard pages and the lyrics of genius pages without building
+the whole html tree. The page is read by an incremental parser which only keeps the text
+of the elements that are needed. A lyrics page is only read until the lyrics end.
+Same result as the BeautifulSoup code in 'scraper.py' and 'genius.py'.
+
+Benchmark against BeautifulSoup on the pages saved by the scraper:
+    python html_extract.py billboard-pages/
+'''
+
+from html.parser import HTMLParser
+import argparse
+import os
+from time import time
+
+# Elements which have no end tag
+void_elements = {'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'link', 'meta', 'param', 'source', 'track', 'wbr'}
+# Text which is not part of the page text
+skip_elements = {'script', 'style', 'template'}
+
+# The chart layouts of billboard (new and old), classes of the item, title and artist
+chart_layouts = [
+    ['ye-chart__item-text', 'ye-chart__item-title', 'ye-chart__item-subtitle'],
+    ['ye-chart-item__text', 'ye-chart-item__title', 'ye-chart-item__artist'],
+]
+
+class StopParsing(Exception):
+    pass
+
+class TargetParser(HTMLParser):
+    '''
+    Keeps track of the open elements, subclasses collect text with 'capture'
+    '''
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.stack = []
+        self.captures = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag in void_elements:
+            return
+        self.stack.append(tag)
+        classes = []
+        for name, value in attrs:
+            if name == 'class' and value:
+                classes = value.split()
+        self.start(tag, classes, len(self.stack))
+
+    def handle_startendtag(self, tag, attrs):
+        pass
+
+    def handle_endtag(self, tag):
+        if tag not in self.stack:
+            return
+        # Elements which are not closed are closed with their parent
+        while self.stack:
+            depth = len(self.stack)
+            if self.stack.pop() == tag:
+                self.end(depth)
+                break
+            self.end(depth)
+
+    def handle_data(self, data):
+        if self.captures and self.stack[-1] not in skip_elements:
+            for capture in self.captures:
+                capture.append(data)
+
+    def capture(self):
+        '''
+        Collect the text from now on, until 'release' is called with the returned list
+        '''
+        text = []
+        self.captures.append(text)
+        return text
+
+    def release(self, text):
+        self.captures.remove(text)
+        return ''.join(text)
+
+    def start(self, tag, classes, depth):
+        pass
+
+    def end(self, depth):
+        pass
+
+    def parse(self, html, chunk_size=2**16):
+        '''
+        Feed 'html' in chunks until done or 'StopParsing' is raised
+        '''
+        try:
+            for start in range(0, len(html), chunk_size):
+                self.feed(html[start:start + chunk_size])
+            self.close()
+            # Elements not closed at the end of the page
+            while self.stack:
+                depth = len(self.stack)
+                self.stack.pop()
+                self.end(depth)
+        except StopParsing:
+            pass
+
+class ChartParser(TargetParser):
+    '''
+    All (song, artist) of the chart items, for each layout in 'chart_layouts'
+    '''
+    def __init__(self):
+        super().__init__()
+        self.items = [[] for layout in chart_layouts]
+        # Open chart items as [layout, depth, title, artist]
+        self.open = []
+        # Open title or artist elements as [item, field, depth, text]
+        self.fields = []
+
+    def start(self, tag, classes, depth):
+        if not classes:
+            return
+        for layout, (item_class, title_class, artist_class) in enumerate(chart_layouts):
+            if item_class in classes:
+                self.open.append([layout, depth, None, None])
+        # Only the first title and artist of an item is used, as 'find' in BeautifulSoup
+        for item in self.open:
+            for field, field_class in [(2, chart_layouts[item[0]][1]), (3, chart_layouts[item[0]][2])]:
+                if field_class in classes and item[field] is None:
+                    item[field] = ''
+                    self.fields.append([item, field, depth, self.capture()])
+
+    def end(self, depth):
+        for field in [field for field in self.fields if field[2] == depth]:
+            item, index, _, text = field
+            item[index] = self.release(text).strip()
+            self.fields.remove(field)
+        for item in [item for item in self.open if item[1] == depth]:
+            layout, _, title, artist = item
+            # An item without title or artist fails in 'scrape_billboard', skipped here
+            if title is not None and artist is not None:
+                self.items[layout].append((title, artist))
+            self.open.remove(item)
+
+class LyricsParser(TargetParser):
+    '''
+    Text of the first <div class="lyrics">, scripts excluded
+    '''
+    def __init__(self):
+        super().__init__()
+        self.depth = None
+        self.text = None
+        self.lyrics = None
+
+    def start(self, tag, classes, depth):
+        if self.depth is None and tag == 'div' and 'lyrics' in classes:
+            self.depth = depth
+            self.text = self.capture()
+
+    def end(self, depth):
+        if depth == self.depth:
+            self.lyrics = self.release(self.text)
+            raise StopParsing()
+
+def chart_items(html):
+    '''
+    List of (song, artist) on a billboard chart page, empty if no chart is found
+    '''
+    parser = ChartParser()
+    parser.parse(html)
+    for items in parser.items:
+        if items:
+            return items
+    return []
+
+def lyrics_text(html):
+    '''
+    Lyrics of a genius song page, None if not found
+    '''
+    parser = LyricsParser()
+    parser.parse(html)
+    return parser.lyrics
+
+def soup_chart_items(html):
+    '''
+    Chart items with BeautifulSoup, as in 'scraper.scrape_billboard'
+    '''
+    from bs4 import BeautifulSoup
+    soup = BeautifulSoup(html, 'html.parser')
+    for item_class, title_class, artist_class in chart_layouts:
+        items = soup.find_all(class_=item_class)
+        if items:
+            result = []
+            for row in items:
+                title, artist = row.find(class_=title_class), row.find(class_=artist_class)
+                if title is not None and artist is not None:
+                    result.append((title.text.strip(), artist.text.strip()))
+            return result
+    return []
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('folder', type=str, help='Folder with saved billboard pages (.html)')
+    parser.add_argument('--repeat', type=int, default=1, help='Number of times each page is parsed')
+
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    args = parse_args()
+
+    pages = []
+    for file_name in sorted(os.listdir(args.folder)):
+        if file_name.endswith('.html'):
+            with open(os.path.join(args.folder, file_name)) as f:
+                pages.append((file_name, f.read()))
+    print('Pages: {}, {:.1f} MB'.format(len(pages), sum(len(html) for _, html in pages) / 2**20))
+
+    times = {}
+    results = {}
+    for name, method in [('BeautifulSoup', soup_chart_items), ('Streaming', chart_items)]:
+        t_start = time()
+        for _ in range(args.repeat):
+            results[name] = [method(html) for _, html in pages]
+        times[name] = time() - t_start
+        print('{:>15}: {:.3f} seconds, {:.1f} pages per second'.format(name, times[name], args.repeat * len(pages) / times[name]))
+
+    different = [file_name for (file_name, _), soup, stream in zip(pages, results['BeautifulSoup'], results['Streaming']) if soup != stream]
+    print('Speedup: {:.1f}x'.format(times['BeautifulSoup'] / times['Streaming']))
+    print('Number of songs: {}'.format(sum(len(items) for items in results['Streaming'])))
+    print('Pages with different result: {}'.format(len(different)))
+    for file_name in different[:10]:
+        print('  {}'.format(file_name))
@@ -0,0 +1,139 @@
+'''
+Persistent cache of http responses, shared by the billboard and genius scrapers.
+Responses are stored compressed on disk by url and query, see 'disk_cache.py'.
+
+A response younger than 'ttl' is used without asking the server. An older response is
+revalidated with its ETag/Last-Modified, if the server answers "304 Not Modified" the cached
+page is used again. In offline mode only the cache is used, so scraping and parsing can be
+run again (and timed) without network.
+
+The cache is off until 'enable' is called, then all requests through 'get' use it.
+'''
+
+from urllib.parse import urlencode
+from disk_cache import DiskCache, cache_key
+import json
+import requests
+import time
+import zlib
+
+class NotCached(Exception):
+    '''
+    Offline and the url is not in the cache
+    '''
+
+class CachedResponse:
+    '''
+    The parts of 'requests.Response' used by the scrapers
+    '''
+    def __init__(self, url, status_code, headers, content, encoding):
+        self.url = url
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+        self.encoding = encoding
+        self.from_cache = True
+
+    @property
+    def text(self):
+        return self.content.decode(self.encoding or 'utf-8', errors='replace')
+
+    def json(self):
+        return json.loads(self.text)
+
+    def raise_for_status(self):
+        pass
+
+class HttpCache(DiskCache):
+    def __init__(self, folder, max_size=1024 * 2**20, ttl=7 * 24 * 3600, offline=False):
+        '''
+        'folder': Where the responses are stored
+        'max_size': Maximum size of the cache in bytes
+        'ttl': Seconds a response is used without revalidation, None to never revalidate
+        'offline': Never use the network
+        '''
+        super().__init__(folder, max_size)
+        self.ttl = ttl
+        self.offline = offline
+        self.hits = 0
+        self.revalidated = 0
+        self.misses = 0
+
+    def load(self, key):
+        '''
+        Cached (metadata, content) of 'key', None if missing
+        '''
+        data = self.read(key)
+        if data is None:
+            return None
+        try:
+            data = zlib.decompress(data)
+        except zlib.error:
+            return None
+        meta, content = data.split(b'\n', 1)
+        return json.loads(meta.decode('utf-8')), content
+
+    def save(self, key, response):
+        meta = {
+            'url': response.url,
+            'time': time.time(),
+            'encoding': response.encoding,
+            'headers': {name: response.headers[name] for name in ['ETag', 'Last-Modified', 'Content-Type'] if name in response.headers},
+        }
+        self.store(key, zlib.compress(json.dumps(meta).encode('utf-8') + b'\n' + response.content))
+
+    def get(self, url, params=None, headers=None, fetch=requests.get, **kwargs):
+        '''
+        Same as 'fetch(url, params=params, headers=headers)' ('requests.get' or 'Session.get'),
+        from the cache if possible. Only successful responses are cached.
+        Headers (like Authorization) are not part of the key.
+        '''
+        key = cache_key(url, urlencode(sorted((params or {}).items())))
+        cached = self.load(key)
+        if cached is not None:
+            meta, content = cached
+            response = CachedResponse(meta['url'], 200, meta['headers'], content, meta['encoding'])
+            if self.offline or self.ttl is None or time.time() - meta['time'] < self.ttl:
+                self.hits += 1
+                return response
+        elif self.offline:
+            raise NotCached('Not in cache (offline): {}'.format(url))
+
+        headers = dict(headers or {})
+        if cached is not None:
+            # Ask the server if the page has changed
+            if 'ETag' in meta['headers']:
+                headers['If-None-Match'] = meta['headers']['ETag']
+            if 'Last-Modified' in meta['headers']:
+                headers['If-Modified-Since'] = meta['headers']['Last-Modified']
+
+        live = fetch(url, params=params, headers=headers, **kwargs)
+        if live.status_code == 304 and cached is not None:
+            self.revalidated += 1
+            meta['time'] = time.time()
+            self.store(key, zlib.compress(json.dumps(meta).encode('utf-8') + b'\n' + content))
+            return response
+
+        self.misses += 1
+        if 200 <= live.status_code < 300:
+            self.save(key, live)
+        return live
+
+# Cache used by 'get', None if not enabled
+cache = None
+
+def enable(folder, max_size=1024 * 2**20, ttl=7 * 24 * 3600, offline=False):
+    '''
+    Use a cache in 'folder' for all requests through 'get', see 'HttpCache'
+    '''
+    global cache
+    cache = HttpCache(folder, max_size, ttl, offline)
+    return cache
+
+def get(url, params=None, headers=None, fetch=requests.get, **kwargs):
+    '''
+    Same as 'requests.get', through the cache if it is enabled
+    '''
+    if cache is None:
+        return fetch(url, params=params, headers=headers, **kwargs)
+    return cache.get(url, params, headers, fetch, **kwargs)
@@ -0,0 +1,75 @@
+'''
+Fuzzy matching of artist and song names with the results of a genius search.
+Only distances up to a limit ('--lev') are of interest, so the Levenshtein distance
+stops as soon as the limit is passed instead of filling the whole table.
+'''
+
+def levenshtein_distance(first, second, max_distance=None):
+    '''
+    Levenshtein distance between two strings.
+    If 'max_distance' is given, the result is only exact up to that distance,
+    any larger distance is returned as 'max_distance' + 1.
+    Only two rows of the table are kept.
+    '''
+    if first == second:
+        return 0
+    if len(first) > len(second):
+        first, second = second, first
+    limit = len(second) if max_distance is None else max_distance
+    # Needs at least one insertion per extra character
+    if len(second) - len(first) > limit:
+        return limit + 1
+
+    # Common prefix and suffix do not change the distance
+    start = 0
+    while start < len(first) and first[start] == second[start]:
+        start += 1
+    end = 0
+    while end < len(first) - start and first[-1-end] == second[-1-end]:
+        end += 1
+    first = first[start:len(first)-end]
+    second = second[start:len(second)-end]
+    if not first:
+        return len(second) if len(second) <= limit else limit + 1
+
+    previous = list(range(len(first) + 1))
+    for j, char in enumerate(second, 1):
+        current = [j]
+        for i, first_char in enumerate(first, 1):
+            current.append(min(
+                previous[i] + 1,
+                current[i-1] + 1,
+                previous[i-1] + (first_char != char),
+            ))
+        # The distance can not be smaller than the smallest value in the row
+        if min(current) > limit:
+            return limit + 1
+        previous = current
+    return previous[-1] if previous[-1] <= limit else limit + 1
+
+def remove_featuring(artist):
+    '''
+    Main artist of the song, without featuring artists (fix for billboard data)
+    '''
+    for separator in [' Featuring', ' With', ' &']:
+        if separator in artist:
+            return artist[:artist.index(separator)]
+    return artist
+
+def first_match(artist, song, candidates, max_distance=0):
+    '''
+    The first of 'candidates' (list of (artist, song)) where the sum of the distances
+    for artist and song is at most 'max_distance'. Names are compared in lower case.
+    Returns (index, distance), or (None, None) if no candidate is close enough.
+    '''
+    artist = artist.lower()
+    song = song.lower()
+    for idx, (q_artist, q_song) in enumerate(candidates):
+        distance = levenshtein_distance(q_artist.lower(), artist, max_distance)
+        if distance > max_distance:
+            continue
+        # The song can only use what is left of the distance
+        distance += levenshtein_distance(q_song.lower(), song, max_distance - distance)
+        if distance <= max_distance:
+            return idx, distance
+    return None, None
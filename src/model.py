@@ -0,0 +1,170 @@
+'''
+Save and load a trained model (sparse backend) without the corpus.
+Training reads and tokenizes all lyrics, a saved model only holds what is needed to
+classify new songs: the settings of the features, the selected n-grams (the columns)
+and the log probability tables of the Naive Bayes model.
+
+Layout of the file:
+    magic (4 bytes), version (uint32), length of header (uint64)
+    header: json with the settings, genres, columns, meta values and where each table is stored
+    tables: float64 arrays (little endian), aligned to 8 bytes, offsets are relative to the start of the tables
+
+The tables are memory-mapped when the model is loaded, so loading does not depend on the size of the model.
+Only the header is parsed, and nltk is only imported if the model tokenizes or stems the lyrics.
+'''
+
+from collections import Counter
+from itertools import islice
+import json
+import mmap
+import os
+import struct
+import numpy as np
+from features import FeatureSpace, SparseSet, lyrics_grams, lyrics_sizes, meta_counts
+from naive_bayes import NaiveBayes
+
+magic = b'CLSM'
+version = 1
+header = struct.Struct('<4sIQ')
+alignment = 8
+
+class Model:
+    def __init__(self, settings, genres, space, meta_names, model):
+        '''
+        'settings': How the lyrics are turned into features, see 'from_classy'
+        'genres': All genres, in the order of the columns of the tables
+        'space': The columns, a 'features.FeatureSpace'
+        'meta_names': Names of the meta features
+        'model': The trained 'naive_bayes.NaiveBayes'
+        '''
+        self.settings = settings
+        self.genres = genres
+        self.space = space
+        self.meta_names = meta_names
+        self.model = model
+        self.stemmer = None
+        self._mmap = None
+
+        if settings['stem']:
+            from stemming import get_stemmer
+            self.stemmer = get_stemmer('english', settings['stem_cache'])
+
+    @classmethod
+    def from_classy(cls, classy):
+        '''
+        The model of a trained 'Classy', only the sparse backend can be saved
+        '''
+        if classy.backend != 'sparse':
+            raise ValueError('Only models trained with the sparse backend can be saved, not "{}"'.format(classy.backend))
+        settings = {
+            'event_model': classy.event_model,
+            'n_grams': classy.feat_n_gram,
+            'hash_bits': classy.hash_bits,
+            'tokenize': classy.feat_tokenize,
+            'stem': classy.feat_stem,
+            'stem_cache': classy.stemmer.max_size,
+            'thresholds': {'chars': classy.num_chars, 'words': classy.num_words, 'unique': classy.num_unique},
+        }
+        return cls(settings, classy.model.genres, classy.space, classy.meta_names, classy.model)
+
+    def save(self, file_name):
+        '''
+        Write the model to 'file_name'
+        '''
+        tables = [('weights', self.model.weights), ('log_base', self.model.log_base)]
+        tables += [('meta_{}'.format(idx), log_prob) for idx, (value_idx, log_prob) in enumerate(self.model.meta)]
+
+        arrays = {}
+        offset = 0
+        for name, table in tables:
+            arrays[name] = [offset, list(table.shape)]
+            offset += table.size * 8
+
+        model_header = {
+            'settings': self.settings,
+            'genres': self.genres,
+            # Prefixes in the order of the columns, and the grams of each prefix by column
+            'columns': [[prefix, list(columns)] for prefix, columns in self.space.columns.items()],
+            'meta_names': self.meta_names,
+            'meta_values': [sorted(value_idx, key=value_idx.get) for value_idx, log_prob in self.model.meta],
+            'arrays': arrays,
+        }
+        header_bytes = json.dumps(model_header).encode('utf-8')
+        header_bytes += b' ' * (-(header.size + len(header_bytes)) % alignment)
+
+        tmp_file = file_name + '.tmp'
+        with open(tmp_file, 'wb') as f:
+            f.write(header.pack(magic, version, len(header_bytes)))
+            f.write(header_bytes)
+            for name, table in tables:
+                f.write(np.ascontiguousarray(table, dtype='<f8').tobytes())
+        os.replace(tmp_file, file_name)
+
+    @classmethod
+    def load(cls, file_name):
+        '''
+        Read a model written by 'save'. The tables are read only views of the file.
+        '''
+        with open(file_name, 'rb') as f:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        file_magic, file_version, header_length = header.unpack_from(data, 0)
+        if file_magic != magic or file_version != version:
+            raise ValueError('Not a model file: "{}"'.format(file_name))
+        model_header = json.loads(data[header.size:header.size + header_length].decode('utf-8'))
+        tables_start = header.size + header_length
+
+        tables = {}
+        for name, (offset, shape) in model_header['arrays'].items():
+            tables[name] = np.frombuffer(data, dtype='<f8', count=int(np.prod(shape)), offset=tables_start + offset).reshape(shape)
+
+        space = FeatureSpace()
+        for prefix, grams in model_header['columns']:
+            space.add(prefix, grams, sort=False)
+
+        meta = []
+        for idx, values in enumerate(model_header['meta_values']):
+            meta.append(({value: value_idx for value_idx, value in enumerate(values)}, tables['meta_{}'.format(idx)]))
+
+        settings = model_header['settings']
+        model = NaiveBayes.from_tables(settings['event_model'], model_header['genres'], tables['weights'], tables['log_base'], meta)
+        loaded = cls(settings, model_header['genres'], space, model_header['meta_names'], model)
+        loaded._mmap = data
+        return loaded
+
+    def row(self, lyrics):
+        '''
+        Row in the feature space and meta counts of 'lyrics', same as 'Classy.get_row_for_song'
+        '''
+        uni_grams, bi_grams, tri_grams, four_grams, five_grams, meta_data, no_meta_lines = lyrics_grams(lyrics, self.settings['n_grams'], self.settings['hash_bits'])
+        if self.settings['tokenize'] or self.settings['stem']:
+            from token_cache import tokenize
+            uni_grams = tokenize(' '.join(no_meta_lines) + ' ', self.settings['tokenize'], self.stemmer)
+
+        grams = {'uni': Counter(uni_grams), 'bi': bi_grams, 'tri': tri_grams, 'four': four_grams, 'five': five_grams}
+        thresholds = self.settings['thresholds']
+        if any(threshold > 0 for threshold in thresholds.values()):
+            sizes = lyrics_sizes(lyrics)
+            for name, threshold in thresholds.items():
+                if threshold > 0 and sizes[name] <= threshold:
+                    grams[name] = {threshold: 1}
+
+        meta = meta_counts(meta_data) if self.meta_names else None
+        return self.space.row(grams), meta
+
+    def classify_batch(self, lyrics_iterable, chunk_size=1000):
+        '''
+        Same as 'Classy.classify_batch'.
+        Yields (song, genre, log_prob) for each item in 'lyrics_iterable' (str or dict with 'lyrics').
+        '''
+        lyrics_iterable = iter(lyrics_iterable)
+        while True:
+            items = list(islice(lyrics_iterable, chunk_size))
+            if not items:
+                break
+            data_set = SparseSet(len(self.space), self.meta_names)
+            for item in items:
+                row, meta = self.row(item['lyrics'] if isinstance(item, dict) else item)
+                data_set.append(row, meta, None)
+            for item, scores in zip(items, self.model.log_posterior(data_set)):
+                yield item, self.genres[scores.argmax()], dict(zip(self.genres, scores.tolist()))
+
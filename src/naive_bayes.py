@@ -0,0 +1,146 @@
+'''
+Naive Bayes on the sparse features from 'features.py'.
+The per-genre log-probability tables are computed with array operations and
+a whole set of songs is scored with one matrix product.
+
+The 'bernoulli' model gives the same result as 'nltk.NaiveBayesClassifier.train',
+which uses the expected likelihood estimate: (count + 0.5) / (N + 0.5 * bins)
+where bins is the number of different values a feature have in the train set.
+The 'multinomial' model uses the number of occurrences of each n-gram instead.
+'''
+
+import numpy as np
+
+class NaiveBayes:
+    def __init__(self, event_model='bernoulli', gamma=0.5):
+        '''
+        'event_model': 'bernoulli' (present or not) or 'multinomial' (counts)
+        'gamma': Smoothing, 0.5 is the expected likelihood estimate used by nltk
+        '''
+        self.event_model = event_model
+        self.gamma = gamma
+
+    def fit(self, data_set):
+        '''
+        Compute the tables from 'data_set', a 'features.SparseSet'
+        Genres are sorted in reverse so that ties are resolved as in nltk (largest label).
+        '''
+        self.genres = sorted(set(data_set.genres), reverse=True)
+        genre_idx = {genre: idx for idx, genre in enumerate(self.genres)}
+        labels = np.array([genre_idx[genre] for genre in data_set.genres], dtype=np.int64)
+        num_genres, num_columns = len(self.genres), data_set.rows.num_columns
+
+        num_songs = np.bincount(labels, minlength=num_genres).astype(np.float64)
+        self.log_prior = np.log2((num_songs + self.gamma) / (len(labels) + self.gamma * num_genres))
+
+        # Number of songs (or occurrences) per genre and column
+        indices = np.frombuffer(data_set.rows.indices, dtype=np.int32)
+        entries = labels[data_set.rows.row_ids()] * num_columns + indices
+        weights = None if self.event_model == 'bernoulli' else np.frombuffer(data_set.rows.data, dtype=np.int32)
+        counts = np.bincount(entries, weights=weights, minlength=num_genres * num_columns).reshape(num_genres, num_columns)
+        self.counts = counts
+
+        if self.event_model == 'bernoulli':
+            # A column which is always (or never) present has only one value
+            total = counts.sum(axis=0)
+            bins = np.where((total > 0) & (total < len(labels)), 2, 1)
+            divisor = num_songs[:, None] + self.gamma * bins[None, :]
+            self.log_true = np.log2((counts + self.gamma) / divisor)
+            self.log_false = np.log2((num_songs[:, None] - counts + self.gamma) / divisor)
+            # A song is scored as the sum of all absent columns plus the difference for the present
+            self.weights = (self.log_true - self.log_false).T
+            self.log_base = self.log_prior + self.log_false.sum(axis=1)
+        else:
+            divisor = counts.sum(axis=1, keepdims=True) + self.gamma * num_columns
+            self.log_true = np.log2((counts + self.gamma) / divisor)
+            self.weights = self.log_true.T
+            self.log_base = self.log_prior.copy()
+
+        # Meta features are categorical, one table per feature with the values seen
+        self.meta = []
+        meta_matrix = data_set.meta_matrix()
+        for column in range(len(data_set.meta_names)):
+            values = meta_matrix[:, column].tolist()
+            value_idx = {value: idx for idx, value in enumerate(sorted(set(values)))}
+            value_counts = np.zeros((num_genres, len(value_idx)))
+            np.add.at(value_counts, (labels, [value_idx[value] for value in values]), 1)
+            meta_divisor = num_songs[:, None] + self.gamma * len(value_idx)
+            # Last column is used for values not seen in the train set
+            log_prob = np.log2(np.hstack([value_counts + self.gamma, np.full((num_genres, 1), self.gamma)]) / meta_divisor)
+            self.meta.append((value_idx, log_prob))
+
+        return self
+
+    @classmethod
+    def from_tables(cls, event_model, genres, weights, log_base, meta):
+        '''
+        Model from saved tables, see 'model.py'. Only used to score songs, it can not be restricted.
+        '''
+        model = cls(event_model)
+        model.genres = genres
+        model.weights = weights
+        model.log_base = log_base
+        model.meta = meta
+        return model
+
+    def restrict(self, columns):
+        '''
+        Weights and base score for a model trained on only the 'columns' (boolean mask).
+        The columns have separate tables, so it is the same as training on fewer features.
+        For the multinomial model the probabilities are normalized over the remaining columns.
+        '''
+        if self.event_model == 'bernoulli':
+            return self.weights * columns[:, None], self.log_prior + (self.log_false * columns).sum(axis=1)
+        divisor = self.counts[:, columns].sum(axis=1, keepdims=True) + self.gamma * columns.sum()
+        return (np.log2((self.counts + self.gamma) / divisor) * columns).T, self.log_prior.copy()
+
+    def log_prob(self, data_set, chunk_size=1024, columns=None):
+        '''
+        Log probability (base 2, not normalized) of each genre for all songs in 'data_set'.
+        Returns a matrix with one row per song and one column per genre in 'self.genres'.
+        The songs are scored in chunks of 'chunk_size' to limit the memory of the dense rows.
+        If 'columns' (boolean mask) is given, only those columns are used, see 'restrict'.
+        '''
+        weights, log_base = (self.weights, self.log_base) if columns is None else self.restrict(columns)
+        binary = self.event_model == 'bernoulli'
+        num_rows = len(data_set.rows)
+        scores = np.empty((num_rows, len(self.genres)))
+        for start in range(0, num_rows, chunk_size):
+            stop = min(start + chunk_size, num_rows)
+            scores[start:stop] = data_set.rows.dense(start, stop, binary=binary) @ weights
+        scores += log_base
+
+        if self.meta:
+            meta_matrix = data_set.meta_matrix()
+            for column, (value_idx, log_prob) in enumerate(self.meta):
+                unseen = log_prob.shape[1] - 1
+                lookup = [value_idx.get(value, unseen) for value in meta_matrix[:, column].tolist()]
+                scores += log_prob[:, lookup].T
+        return scores
+
+    def log_posterior(self, data_set):
+        '''
+        Log probability of each genre normalized over the genres (base 2, as 'prob_classify' in nltk)
+        '''
+        scores = self.log_prob(data_set)
+        scores -= np.logaddexp2.reduce(scores, axis=1)[:, None]
+        return scores
+
+    def predict(self, data_set, columns=None):
+        '''
+        Most probable genre for every song in 'data_set'
+        '''
+        return [self.genres[idx] for idx in self.log_prob(data_set, columns=columns).argmax(axis=1)]
+
+    def most_informative(self, n):
+        '''
+        The 'n' columns with the largest ratio between the most and least likely genre.
+        Returns list of (column, high genre, low genre, ratio)
+        '''
+        ratio = self.log_true.max(axis=0) - self.log_true.min(axis=0)
+        result = []
+        for column in np.argsort(-ratio, kind='stable')[:n]:
+            high = self.genres[self.log_true[:, column].argmax()]
+            low = self.genres[self.log_true[:, column].argmin()]
+            result.append((column, high, low, 2 ** ratio[column]))
+        return result
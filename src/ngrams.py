@@ -0,0 +1,262 @@
+'''
+Counting of n-grams in the train set.
+Each song is tokenized once and the counts for every order are updated incrementally,
+so memory depends on the number of different n-grams and not the size of the corpus.
+With 'hash_bits' the n-grams of order 2 and up are counted in fixed size arrays, one per order.
+With a 'Vocabulary' the songs are given as arrays of n-gram ids (see 'vocabulary.py') and
+all orders are counted in arrays indexed by id.
+'''
+
+from collections import Counter
+from features import hash_ngrams
+from token_cache import tokenize
+import heapq
+import numpy as np
+
+# Prefix of the n-grams, index + 1 is the order
+orders = ['uni', 'bi', 'tri', 'four', 'five']
+
+def song_lines(lyrics):
+    '''
+    The words (split on space) of each line of a song the n-grams are counted from.
+    Metadata lines ('[Chorus]' etc) are ignored since they can contain the name of the artist.
+    '''
+    lines = []
+    for line in lyrics.split('\n'):
+        if len(line) <= 1:
+            continue
+        line = line.rstrip()
+        if not line or line[0] + line[-1] == '[]':
+            continue
+        lines.append(line.split(' '))
+    return lines
+
+def song_grams(lyrics, max_order=5, word_tokenize=False, stemmer=None, cache=None, hash_bits=0):
+    '''
+    All n-grams in the lines of a song ('song_lines'), list with one Counter per order.
+    The arguments are the same as for 'NgramCounter' ('word_tokenize' is its 'tokenize'), without the count arrays.
+    '''
+    grams = [Counter() for _ in range(max_order)]
+    lines = song_lines(lyrics)
+    # Orders counted as joined strings
+    string_order = 1 if hash_bits else max_order
+    for words in lines:
+        for idx, word in enumerate(words):
+            # Ignore double space
+            if len(word.rstrip()) == 0:
+                continue
+            grams[0][word.rstrip()] += 1
+            for order in range(1, min(idx + 1, string_order)):
+                grams[order]['|'.join(words[idx-order:idx+1])] += 1
+
+    if hash_bits and max_order > 1:
+        grams[1:] = hash_ngrams(lines, max_order, hash_bits)
+
+    if word_tokenize or stemmer is not None:
+        text = ' '.join(' '.join(words) for words in lines) + ' '
+        if cache is not None:
+            grams[0] = Counter(cache.tokens(text, word_tokenize, stemmer))
+        else:
+            grams[0] = Counter(tokenize(text, word_tokenize, stemmer))
+    return grams
+
+class NgramCounter:
+    def __init__(self, max_order=5, tokenize=False, stemmer=None, cache=None, hash_bits=0, vocabulary=None):
+        '''
+        'max_order': Count n-grams up to this order, 1 if only unigrams are needed
+        'tokenize': Unigrams are from 'word_tokenize' instead of split on space
+        'stemmer': If set, unigrams are stemmed
+        'cache': A 'TokenCache' to reuse the tokenized unigrams
+        'hash_bits': If set, n-grams of order 2 and up are hashed to 2**hash_bits buckets
+        'vocabulary': If set, 'add' is given the interned n-grams of the songs
+        '''
+        self.max_order = max_order
+        self.tokenize = tokenize
+        self.stemmer = stemmer
+        self.cache = cache
+        self.hash_bits = hash_bits
+        self.vocabulary = vocabulary
+        if vocabulary is not None:
+            self.counts = [np.zeros(vocabulary.size(order), dtype=np.int64) for order in range(1, max_order+1)]
+            # Position where each id was first seen, ties are ranked by it as with the Counters
+            self.first = [np.full(vocabulary.size(order), np.iinfo(np.int64).max) for order in range(1, max_order+1)]
+            self.position = [0] * max_order
+        else:
+            self.counts = [Counter()]
+            for _ in range(1, max_order):
+                self.counts.append(np.zeros(2**hash_bits, dtype=np.int32) if hash_bits else Counter())
+            if hash_bits:
+                # Position where each bucket was first seen, see 'first' above
+                self.first = [None] + [np.full(2**hash_bits, np.iinfo(np.int64).max) for _ in range(1, max_order)]
+                self.position = [0] * max_order
+        # Tie order used instead of the first positions, see 'first_seen'
+        self.ties = None
+        self.num_songs = 0
+
+    def song_grams(self, lyrics):
+        '''
+        All n-grams in a song with the settings of the counter, see 'song_grams'
+        '''
+        return song_grams(lyrics, self.max_order, self.tokenize, self.stemmer, self.cache, self.hash_bits)
+
+    def add(self, lyrics, grams=None):
+        '''
+        Add the n-grams of a song to the counts.
+        'grams' can be given if the song already is counted with 'song_grams'.
+        '''
+        self.update(self.song_grams(lyrics) if grams is None else grams)
+        self.num_songs += 1
+
+    def _song_ids(self, song_counts):
+        '''
+        The ids (or buckets) of one order of a song as an array, in the order they were counted
+        '''
+        if self.vocabulary is not None:
+            return np.frombuffer(song_counts[0], dtype=np.uint32)
+        return np.fromiter(song_counts.keys(), dtype=np.int64, count=len(song_counts))
+
+    def update(self, grams, sign=1):
+        '''
+        Add (or remove if 'sign' is -1) the counts 'grams' from 'song_grams',
+        or (ids, counts) arrays from 'Vocabulary.intern' if the counter has a vocabulary
+        '''
+        if self.vocabulary is not None:
+            for order, (counts, song_counts) in enumerate(zip(self.counts, grams)):
+                song_ids = self._song_ids(song_counts)
+                counts[song_ids] += sign * np.frombuffer(song_counts[1], dtype=np.uint32).astype(np.int64)
+                if sign > 0:
+                    first = self.first[order]
+                    first[song_ids] = np.minimum(first[song_ids], self.position[order] + np.arange(len(song_ids)))
+                    self.position[order] += len(song_ids)
+            return
+        for order, (counts, song_counts) in enumerate(zip(self.counts, grams)):
+            if isinstance(counts, np.ndarray):
+                if song_counts:
+                    buckets = self._song_ids(song_counts)
+                    counts[buckets] += sign * np.fromiter(song_counts.values(), dtype=np.int64, count=len(song_counts))
+                    if sign > 0:
+                        first = self.first[order]
+                        first[buckets] = np.minimum(first[buckets], self.position[order] + np.arange(len(buckets)))
+                        self.position[order] += len(buckets)
+            elif sign > 0:
+                counts.update(song_counts)
+            else:
+                counts.subtract(song_counts)
+
+    def positions(self):
+        '''
+        Position of the next new n-gram of each order, marks the songs counted so far for 'first_seen'
+        '''
+        return [self.position[order] if isinstance(counts, np.ndarray) else len(counts) for order, counts in enumerate(self.counts)]
+
+    def first_seen(self, mark=None, songs=()):
+        '''
+        Rank ties by the first occurrence in the songs counted before 'mark' (from 'positions')
+        followed by 'songs' (from 'song_grams'), instead of in all counted songs.
+        Used for a fold in 'Classy.cross_validate', where the train songs are the songs before
+        the fold and the songs after it. Without 'mark' the order of all counted songs is used again.
+        '''
+        self.ties = None
+        if mark is None:
+            return
+        ties = []
+        for order, counts in enumerate(self.counts):
+            if isinstance(counts, np.ndarray):
+                first = self.first[order]
+                order_ties = np.where(first < mark[order], first, np.iinfo(np.int64).max)
+                position = mark[order]
+                for grams in songs:
+                    song_ids = self._song_ids(grams[order])
+                    order_ties[song_ids] = np.minimum(order_ties[song_ids], position + np.arange(len(song_ids)))
+                    position += len(song_ids)
+            else:
+                # Position after 'mark' of the n-grams in 'songs', n-grams counted before 'mark' keep their index
+                order_ties = {}
+                for grams in songs:
+                    for gram in grams[order]:
+                        order_ties.setdefault(gram, mark[order] + len(order_ties))
+            ties.append((mark[order], order_ties))
+        self.ties = ties
+
+    def _first(self, order):
+        '''
+        Position of each id (or bucket) of 'order' used to rank ties
+        '''
+        return self.first[order-1] if self.ties is None else self.ties[order-1][1]
+
+    def total(self, order):
+        '''
+        Number of n-grams of 'order' counted, with repetitions
+        '''
+        counts = self.counts[order-1]
+        return int(counts.sum()) if isinstance(counts, np.ndarray) else sum(counts.values())
+
+    def ranked(self, order, stopwords=None):
+        '''
+        All n-grams of 'order' which occur more than once, sorted by count.
+        Ties keep the order in which the n-grams were first seen.
+        If 'stopwords' is given, n-grams in it (lowercase) are skipped.
+        '''
+        if self.vocabulary is not None:
+            return self._ranked_ids(order, stopwords)
+        if isinstance(self.counts[order-1], np.ndarray):
+            return self._ranked_buckets(order)
+        return [gram for _, _, gram in sorted(self._candidates(order, stopwords))]
+
+    def top(self, order, num, stopwords=None):
+        '''
+        The 'num' most common n-grams of 'order' as a set, see 'top_ranked'
+        '''
+        return set(self.top_ranked(order, num, stopwords))
+
+    def top_ranked(self, order, num, stopwords=None):
+        '''
+        The 'num' most common n-grams of 'order', same ranking as 'ranked'.
+        Uses a heap of size 'num' instead of sorting all n-grams.
+        The top n-grams for a smaller 'num' are the first n-grams of the list.
+        '''
+        if self.vocabulary is not None:
+            return self._ranked_ids(order, stopwords, num)
+        if isinstance(self.counts[order-1], np.ndarray):
+            return self._ranked_buckets(order)[:max(num, 0)]
+        return [gram for _, _, gram in heapq.nsmallest(num, self._candidates(order, stopwords))]
+
+    def _ranked_buckets(self, order):
+        '''
+        Hashed n-grams which occur more than once, sorted by count.
+        Ties keep the order in which the buckets were first seen, as for the strings.
+        '''
+        counts = self.counts[order-1]
+        buckets = np.nonzero(counts > 1)[0]
+        return buckets[np.lexsort((self._first(order)[buckets], -counts[buckets]))].tolist()
+
+    def _ranked_ids(self, order, stopwords, num=None):
+        '''
+        'ranked' (or 'top_ranked' if 'num' is set) for counts by id, returns the n-grams.
+        '''
+        counts = self.counts[order-1]
+        ids = np.nonzero(counts > 1)[0]
+        ids = ids[np.lexsort((self._first(order)[ids], -counts[ids]))]
+        if num is not None and not stopwords:
+            return [self.vocabulary.gram(order, idx) for idx in ids[:max(num, 0)].tolist()]
+        result = []
+        for idx in ids.tolist():
+            if num is not None and len(result) >= num:
+                break
+            gram = self.vocabulary.gram(order, idx)
+            if stopwords and gram.lower() in stopwords:
+                continue
+            result.append(gram)
+        return result
+
+    def _candidates(self, order, stopwords):
+        mark, ties = self.ties[order-1] if self.ties is not None else (None, None)
+        for idx, (gram, cnt) in enumerate(self.counts[order-1].items()):
+            if cnt <= 1:
+                continue
+            if stopwords and gram.lower() in stopwords:
+                continue
+            # Counted with a positive count after 'mark', so it is in 'ties'
+            if mark is not None and idx >= mark:
+                idx = ties[gram]
+            yield -cnt, idx, gram
@@ -10,7 +10,9 @@ import nltk
 import json
 import os
 import argparse
+from multiprocessing import Pool
 from w8m8 import progressbar
+from corpus import open_corpus
 
 def parse_args():
     '''
@@ -22,28 +24,71 @@ def parse_args():
     parser.add_argument('file', type=str, help='Name of json file')
     parser.add_argument('output_file', type=str, help='Name of output file')
     parser.add_argument('--folder_name', type=str, default='lyrics', help='Name of folder to look for songs')
+    parser.add_argument('--corpus', type=str, default='', help='Packed corpus file (from "corpus.py"), used instead of the folder')
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count(), help='Number of processes used to check the songs')
 
     return parser.parse_args()
 
 english_stopwords = set(nltk.corpus.stopwords.words('english'))
 non_english_stopwords = set(nltk.corpus.stopwords.words()) - english_stopwords
 
-stopwords = {lang: set(nltk.corpus.stopwords.words(lang)) for lang in nltk.corpus.stopwords.fileids()}
+languages = nltk.corpus.stopwords.fileids()
+
+# Inverted index, stopword -> the languages (index in 'languages') which have it
+stopword_languages = {}
+for lang_idx, lang in enumerate(languages):
+    for word in set(nltk.corpus.stopwords.words(lang)):
+        stopword_languages.setdefault(word, []).append(lang_idx)
 
 def get_language(text):
-    words = set(nltk.wordpunct_tokenize(text.lower()))
-    return max(((lang, len(words & stopwords)) for lang, stopwords in stopwords.items()), key = lambda x: x[1])[0]
+    '''
+    Language with the most stopwords in the text, the first language in 'languages' if equal.
+    Each word is looked up once in the index instead of comparing with every language.
+    '''
+    scores = [0] * len(languages)
+    for word in set(nltk.wordpunct_tokenize(text.lower())):
+        for lang_idx in stopword_languages.get(word, ()):
+            scores[lang_idx] += 1
+    return languages[scores.index(max(scores))]
 
 def is_english(text):
     words = set(nltk.wordpunct_tokenize(text.lower()))
     return len(words & english_stopwords) > len(words & non_english_stopwords)
 
+lyrics_source = None
+
+def _init_worker(corpus_file, folder_name):
+    global lyrics_source
+    lyrics_source = open_corpus(corpus_file, folder_name)
+
+def check_song(entry):
+    '''
+    Reason why the song should be removed, None if it is kept.
+    Returns (reason, artist + song), the lyrics are not sent back to the main process
+    '''
+    artist, song, genre = entry
+    lyrics = lyrics_source.get(artist, song)
+    if lyrics is None:
+        return 'file not found', artist + song
+
+    unique_words = set(lyrics.replace('\n', ' ').split(' '))
+    if 'instrumental' in lyrics.lower():
+        if len(unique_words) < 5:
+            return 'instrumental', artist + song
+    if len(lyrics) < 100:
+        return 'less < 100 chars', artist + song
+
+    if get_language(lyrics) != 'english':
+        return 'no-english', artist + song
+    return None, artist + song
+
 def analyze_file(args):
     '''
     Takes an project file.
     Goes through all lyrics in it.
     If the lyrics doesn't exist or if the lyrics is in another language than english,
     the entry is removed from the json file.
+    The songs are checked in 'jobs' processes, each reads the lyrics from the corpus itself.
     '''
     data = json.load(open(args.file))
     print()
@@ -54,39 +99,34 @@ def analyze_file(args):
     failed = []
     new_data = {}
     valid_cntr = 0
-    for idx, (artist, song, genre) in data.items():
-        file_path = os.path.join(args.folder_name, '{}~{}'.format(artist.replace('/', ''), song.replace('/', '')))
-        progressbar((int(idx)+1)/len(data))
-        if os.path.exists(file_path):
-            lyrics = open(file_path).read()
-
-            unique_words = set(lyrics.replace('\n', ' ').split(' '))
-            if 'instrumental' in lyrics.lower():
-                if len(unique_words) < 5:
-                    failed.append(['instrumental', artist + song, lyrics])
-                    continue
-            if len(lyrics) < 100:
-                failed.append(['less < 100 chars', artist + song, lyrics])
-                continue
-
-            language = get_language(lyrics)
-
-            language = get_language(lyrics)
-            if language != 'english':
-                failed.append(['no-english', artist + song, lyrics])
-                continue
-
-            new_data[valid_cntr] = [artist, song, genre]
-            valid_cntr += 1
-        else:
-            failed.append(['file not found', artist + song, ''])
+    entries = list(data.values())
+    if args.jobs > 1:
+        pool = Pool(args.jobs, _init_worker, (args.corpus, args.folder_name))
+        results = pool.imap(check_song, entries, max(1, min(100, len(entries) // (4 * args.jobs))))
+    else:
+        pool = None
+        _init_worker(args.corpus, args.folder_name)
+        results = map(check_song, entries)
+
+    for idx, ((artist, song, genre), (reason, name)) in enumerate(zip(entries, results)):
+        progressbar((idx+1)/len(data))
+        if reason is not None:
+            failed.append([reason, name])
+            continue
+
+        new_data[valid_cntr] = [artist, song, genre]
+        valid_cntr += 1
+
+    if pool is not None:
+        pool.close()
+        pool.join()
 
     failed.sort()
 
     if failed:
         print()
         print('Songs failed, removed: {}'.format(len(failed)))
-    for reason, name, lyrics in failed:
+    for reason, name in failed:
         print('  "{}": "{}"'.format(reason, name))
 
     print()
@@ -0,0 +1,160 @@
+'''
+Timing, memory and counters for the stages of the classifier.
+Code is split in named stages with 'stage' and counts things (songs, tokens, features) with 'count'.
+Stages inside other stages are named by their path, like 'iteration/train'.
+Each stage records the number of calls, wall and cpu seconds, the resident memory of the process
+at the end and, if memory tracing is on, the peak of the memory allocated by python (tracemalloc).
+
+Profiling is off until 'enable' is called, then 'stage' and 'count' do nothing.
+Only the current process is measured, not the worker processes ('--jobs').
+'''
+
+from contextlib import contextmanager, nullcontext
+import json
+import os
+import time
+import tracemalloc
+
+def rss_mb():
+    '''
+    Resident memory of the process in MB, None if not known (only on Linux)
+    '''
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2**20
+    except (OSError, ValueError, IndexError):
+        return None
+
+class Profiler:
+    def __init__(self, memory=False):
+        '''
+        'memory': Trace the memory allocations, slows down the program
+        '''
+        self.memory = memory
+        self.traced = memory and not tracemalloc.is_tracing()
+        if self.traced:
+            tracemalloc.start()
+        self.t_start = time.perf_counter()
+        self.stages = {}
+        self.counters = {}
+        # Open stages as [stats, peak of the allocated memory]
+        self.open = []
+
+    @contextmanager
+    def stage(self, name):
+        path = '/'.join([stats['name'] for stats, _ in self.open] + [name])
+        stats = self.stages.setdefault(path, {'name': name, 'calls': 0, 'seconds': 0.0, 'cpu_seconds': 0.0, 'counters': {}})
+        if self.memory:
+            # The peak is reset for each stage, keep the peak so far of the parent
+            if self.open:
+                self.open[-1][1] = max(self.open[-1][1], tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+        self.open.append([stats, 0])
+        t_wall = time.perf_counter()
+        t_cpu = time.process_time()
+        try:
+            yield stats
+        finally:
+            stats['calls'] += 1
+            stats['seconds'] += time.perf_counter() - t_wall
+            stats['cpu_seconds'] += time.process_time() - t_cpu
+            _, peak = self.open.pop()
+            rss = rss_mb()
+            if rss is not None:
+                stats['rss_mb'] = max(stats.get('rss_mb', 0), rss)
+            if self.memory:
+                peak = max(peak, tracemalloc.get_traced_memory()[1])
+                stats['peak_mb'] = max(stats.get('peak_mb', 0), peak / 2**20)
+                if self.open:
+                    self.open[-1][1] = max(self.open[-1][1], peak)
+
+    def count(self, name, value=1):
+        '''
+        Add 'value' to the counter 'name' of the current stage
+        '''
+        counters = self.open[-1][0]['counters'] if self.open else self.counters
+        counters[name] = counters.get(name, 0) + value
+
+    def report(self):
+        '''
+        Everything recorded so far, as a dict which can be saved as json
+        '''
+        stages = {}
+        for path, stats in self.stages.items():
+            stats = dict(stats)
+            del stats['name']
+            stages[path] = stats
+        return {
+            'seconds': time.perf_counter() - self.t_start,
+            'rss_mb': rss_mb(),
+            'memory_traced': self.memory,
+            'counters': dict(self.counters),
+            'stages': stages,
+        }
+
+    def stop(self):
+        if self.traced:
+            tracemalloc.stop()
+            self.traced = False
+
+# Profiler used by the functions below, None if not enabled
+profiler = None
+
+def enable(memory=False):
+    '''
+    Start recording stages, see 'Profiler'. Earlier records are dropped.
+    '''
+    global profiler
+    disable()
+    profiler = Profiler(memory)
+    return profiler
+
+def disable():
+    global profiler
+    if profiler is not None:
+        profiler.stop()
+    profiler = None
+
+def stage(name):
+    '''
+    Context manager around a stage, as 'with profiling.stage('train'):'
+    '''
+    if profiler is None:
+        return nullcontext()
+    return profiler.stage(name)
+
+def count(name, value=1):
+    if profiler is not None:
+        profiler.count(name, value)
+
+def report():
+    '''
+    The report of the profiler, None if not enabled
+    '''
+    return profiler.report() if profiler is not None else None
+
+def dump(path):
+    '''
+    Save the report as json to 'path'
+    '''
+    tmp_path = '{}.tmp'.format(path)
+    with open(tmp_path, 'w') as f:
+        json.dump(report(), f, indent=4, sort_keys=True)
+    os.replace(tmp_path, path)
+
+def show(data=None):
+    '''
+    Print the stages of a report (the current one if not given)
+    '''
+    data = report() if data is None else data
+    if data is None:
+        return
+    print('{:<32} {:>6} {:>10} {:>10} {:>10} {:>10}'.format('Stage', 'Calls', 'Seconds', 'CPU', 'RSS MB', 'Peak MB'))
+    for path, stats in data['stages'].items():
+        print('{:<32} {:>6} {:>10.3f} {:>10.3f} {:>10} {:>10}'.format(
+            path, stats['calls'], stats['seconds'], stats['cpu_seconds'],
+            '{:.1f}'.format(stats['rss_mb']) if 'rss_mb' in stats else '-',
+            '{:.1f}'.format(stats['peak_mb']) if 'peak_mb' in stats else '-'))
+        for name, value in sorted(stats['counters'].items()):
+            print('    {}: {}'.format(name, value))
+    print('Total: {:.3f} seconds'.format(data['seconds']))
@@ -3,11 +3,12 @@ Scrapes billboard links and stores the data in json file
 Clean the files by removing duplicates
 '''
 
+import argparse
 import os
 import sys
 import json
-from bs4 import BeautifulSoup
-import requests
+from html_extract import chart_items
+import http_cache
 from w8m8 import progressbar
 from collections import Counter
 
@@ -35,34 +36,24 @@ def scrape_billboard(billboard_file='billboard-links.json', db_file_name='url-db
     cntr, url_cntr = 0, 0
     failed_links = []
     working_archive = set()
-    chart_items = {
-        False: [['ye-chart-item__text', 'div'], ['ye-chart-item__title', 'div'], ['ye-chart-item__artist', 'div']],
-        True: [['ye-chart__item-text', 'div'], ['ye-chart__item-title', 'h1'], ['ye-chart__item-subtitle', 'h2']],
-    }
     genre_distribution = []
     for genre, urls in billboard_links.items():
         for url in urls:
             url_cntr += 1
 
-            page = requests.get(url)
-            soup = BeautifulSoup(page.text, 'html.parser')
+            page = http_cache.get(url)
 
             with open('billboard-pages/' + url.replace('/', '|') + '.html', 'w') as f:
                 f.write(page.text)
             print('\033[F\033[K"{}": {}'.format(genre, url))
 
-            class_base = chart_items[True]
-            items = soup.find_all('', {'class': class_base[0][0]})
-            if not items:
-                class_base = chart_items[False]
-                items = soup.find_all('', {'class': class_base[0][0]})
+            # Both chart layouts are tried, see 'html_extract.chart_layouts'
+            items = chart_items(page.text)
             if not items:
                 failed_links.append([genre, url])
-            for row in items:
+            for song, artist in items:
                 if 'archive' in url:
                     working_archive.add(url)
-                song = row.find('', {'class': class_base[1][0]}).text.strip()
-                artist = row.find('', {'class': class_base[2][0]}).text.strip()
 
                 artist = artist.replace(u'\u200b', '')
                 song = song.replace(u'\u200b', '')
@@ -156,6 +147,28 @@ def clean_duplicates(file_name):
         json.dump(data, f, indent=4)
     print('Saved to: "{}"'.format(file_name))
 
+def parse_args():
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('--bb_file', type=str, default='billboard-links.json', help='File with billboard links to scrape')
+    parser.add_argument('--db_file', type=str, default='url-db.json', help='List of all songs with their url')
+    parser.add_argument('--genre_file', type=str, default='billboard.json', help='File to store the songs with their genre in')
+
+    parser.add_argument('--http_cache', type=str, default='http-cache', help='Folder to cache downloaded pages in, empty to not cache')
+    parser.add_argument('--cache_size', type=int, default=1024, help='Maximum size of the http cache in MB')
+    parser.add_argument('--cache_ttl', type=float, default=7*24, help='Hours before a cached page is checked with the server again')
+    parser.add_argument('--offline', action='store_true', help='Only use pages in the http cache, never the network')
+
+    return parser.parse_args()
+
 if __name__ == '__main__':
-    scrape_billboard()
-    clean_duplicates(genre_file_name)
+    args = parse_args()
+
+    if args.http_cache:
+        http_cache.enable(args.http_cache, args.cache_size * 2**20, args.cache_ttl * 3600, args.offline)
+    elif args.offline:
+        print('--offline needs --http_cache')
+        sys.exit(1)
+
+    scrape_billboard(args.bb_file, args.db_file, args.genre_file)
+    clean_duplicates(args.genre_file)
@@ -0,0 +1,257 @@
+'''
+Classification server. Loads a saved model (see "tag-lyrics.py --save_model") once
+and classifies lyrics sent over HTTP, so nltk is not imported and nothing is trained per song.
+
+Requests that arrive at the same time are collected in batches and each batch is scored with
+one call to the model, see 'Batcher'.
+
+    python serve.py billboard.model --port 8000
+    curl -d '{"lyrics": "..."}' localhost:8000/classify
+
+Endpoints:
+    POST /classify  {"lyrics": "..."} or {"songs": [{"name": ..., "lyrics": ...}, ...]}
+                    Returns genre, log probability (base 2) and probability of each genre.
+    GET  /metrics   Number of requests and songs, batch sizes, latency and throughput.
+    GET  /health    "ok" when the model is loaded.
+
+With '--socket' the server listens on a Unix socket instead of a port.
+'''
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from socketserver import ThreadingMixIn, UnixStreamServer
+from collections import deque
+from threading import Condition, Event, Lock, Thread
+from time import time
+import argparse
+import json
+import os
+import signal
+from model import Model
+
+class Metrics:
+    '''
+    Counters and the latency of the last requests
+    '''
+    def __init__(self, window=10000):
+        self.lock = Lock()
+        self.start = time()
+        self.requests = 0
+        self.errors = 0
+        self.songs = 0
+        self.batches = 0
+        self.batch_songs = 0
+        self.max_batch = 0
+        self.latencies = deque(maxlen=window)
+
+    def add_request(self, num_songs, latency):
+        with self.lock:
+            self.requests += 1
+            self.songs += num_songs
+            self.latencies.append(latency)
+
+    def add_error(self):
+        with self.lock:
+            self.errors += 1
+
+    def add_batch(self, num_songs):
+        with self.lock:
+            self.batches += 1
+            self.batch_songs += num_songs
+            self.max_batch = max(self.max_batch, num_songs)
+
+    def summary(self):
+        with self.lock:
+            latencies = sorted(self.latencies)
+            uptime = time() - self.start
+            summary = {
+                'uptime': uptime,
+                'requests': self.requests,
+                'errors': self.errors,
+                'songs': self.songs,
+                'batches': self.batches,
+                'mean_batch': self.batch_songs / self.batches if self.batches else 0,
+                'max_batch': self.max_batch,
+                'songs_per_second': self.songs / uptime if uptime > 0 else 0,
+                'latency_ms': {},
+            }
+        if latencies:
+            summary['latency_ms'] = {
+                'mean': 1000 * sum(latencies) / len(latencies),
+                'p50': 1000 * latencies[int(0.5 * (len(latencies) - 1))],
+                'p90': 1000 * latencies[int(0.9 * (len(latencies) - 1))],
+                'p99': 1000 * latencies[int(0.99 * (len(latencies) - 1))],
+                'max': 1000 * latencies[-1],
+            }
+        return summary
+
+class Batcher:
+    '''
+    Collects songs from all request threads and scores them in batches in one thread.
+    A batch is started when a song is waiting, it is scored after 'max_wait' seconds
+    or when 'max_batch' songs have arrived, whichever comes first.
+    '''
+    def __init__(self, model, metrics, max_batch=256, max_wait=0.005):
+        self.model = model
+        self.metrics = metrics
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.pending = []
+        self.condition = Condition()
+        self.thread = Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def classify(self, songs):
+        '''
+        Genre and log probability of each song in 'songs' (list of lyrics), blocks until scored
+        '''
+        jobs = [{'lyrics': lyrics, 'done': Event()} for lyrics in songs]
+        with self.condition:
+            self.pending.extend(jobs)
+            self.condition.notify()
+        for job in jobs:
+            job['done'].wait()
+            if 'error' in job:
+                raise job['error']
+        return [(job['genre'], job['log_prob']) for job in jobs]
+
+    def score(self, jobs):
+        for job, genre, log_prob in self.model.classify_batch(jobs, len(jobs)):
+            job['genre'], job['log_prob'] = genre, log_prob
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.pending:
+                    self.condition.wait()
+                # Wait a little for more songs, unless the batch is already full
+                deadline = time() + self.max_wait
+                while len(self.pending) < self.max_batch and time() < deadline:
+                    self.condition.wait(deadline - time())
+                batch = self.pending[:self.max_batch]
+                self.pending = self.pending[self.max_batch:]
+
+            try:
+                self.score(batch)
+            except Exception:
+                # Score the songs one at a time, so only the song which fails gets the error
+                for job in batch:
+                    try:
+                        self.score([job])
+                    except Exception as e:
+                        job['error'] = e
+            self.metrics.add_batch(len(batch))
+            for job in batch:
+                job['done'].set()
+
+class Handler(BaseHTTPRequestHandler):
+    def send_json(self, data, status=200):
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == '/metrics':
+            self.send_json(self.server.metrics.summary())
+        elif self.path == '/health':
+            self.send_json('ok')
+        else:
+            self.send_json({'error': 'Not found: {}'.format(self.path)}, 404)
+
+    def do_POST(self):
+        if self.path != '/classify':
+            self.send_json({'error': 'Not found: {}'.format(self.path)}, 404)
+            return
+
+        t_start = time()
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))).decode('utf-8'))
+            single = 'lyrics' in request
+            songs = [request] if single else request['songs']
+            lyrics = [song['lyrics'] for song in songs]
+            if not all(isinstance(text, str) for text in lyrics):
+                raise TypeError('"lyrics" must be a string')
+        except (ValueError, KeyError, TypeError) as e:
+            self.server.metrics.add_error()
+            self.send_json({'error': 'Bad request: {}'.format(e)}, 400)
+            return
+
+        try:
+            results = self.server.batcher.classify(lyrics)
+        except Exception as e:
+            self.server.metrics.add_error()
+            self.send_json({'error': str(e)}, 500)
+            return
+
+        response = []
+        for song, (genre, log_prob) in zip(songs, results):
+            result = {'genre': genre, 'log_prob': log_prob, 'prob': {key: 2 ** value for key, value in log_prob.items()}}
+            if 'name' in song:
+                result['name'] = song['name']
+            response.append(result)
+        self.send_json(response[0] if single else {'songs': response})
+        self.server.metrics.add_request(len(songs), time() - t_start)
+
+    def address_string(self):
+        # Unix sockets have no client address
+        return self.client_address[0] if self.client_address else self.server.server_address
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+class Server(ThreadingHTTPServer):
+    # Many clients connect at the same time, the default backlog is 5
+    request_queue_size = 128
+
+class UnixServer(ThreadingMixIn, UnixStreamServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('model', type=str, help='Saved model, from "tag-lyrics.py --save_model"')
+    parser.add_argument('--host', type=str, default='127.0.0.1', help='Address to listen on')
+    parser.add_argument('--port', type=int, default=8000, help='Port to listen on')
+    parser.add_argument('--socket', type=str, default='', help='Listen on this Unix socket instead of a port')
+    parser.add_argument('--max_batch', type=int, default=256, help='Maximum number of songs scored at the same time')
+    parser.add_argument('--max_wait', type=float, default=5, help='Milliseconds to wait for more songs before a batch is scored')
+    parser.add_argument('-v', '--verbose', action='store_true', help='Print every request')
+
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    args = parse_args()
+
+    t_start = time()
+    model = Model.load(args.model)
+    print('Loaded model "{}" in {:.3f} seconds'.format(args.model, time() - t_start))
+
+    if args.socket:
+        if os.path.exists(args.socket):
+            os.remove(args.socket)
+        server = UnixServer(args.socket, Handler)
+        address = args.socket
+    else:
+        server = Server((args.host, args.port), Handler)
+        address = 'http://{}:{}'.format(args.host, args.port)
+
+    server.metrics = Metrics()
+    server.batcher = Batcher(model, server.metrics, args.max_batch, args.max_wait / 1000)
+    server.verbose = args.verbose
+
+    # Stop in the same way on Ctrl-C and kill
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+
+    print('Listening on {}'.format(address))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print()
+    finally:
+        server.server_close()
+        if args.socket:
+            os.remove(args.socket)
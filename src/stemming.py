@@ -0,0 +1,41 @@
+'''
+Memoized stemming.
+Lyrics are very repetitive, so each different word is stemmed once and looked up in a table after that.
+One table is shared by all classifiers in the process (iterations and tests in 'evaluate_system').
+Worker processes get a copy of the table when they are started.
+'''
+
+from nltk.stem.snowball import SnowballStemmer
+
+class MemoStemmer:
+    def __init__(self, language='english', max_size=100000):
+        '''
+        'max_size': Maximum number of words in the table.
+        When full, the oldest half of the table is removed.
+        '''
+        self.stemmer = SnowballStemmer(language)
+        self.max_size = max_size
+        self.table = {}
+
+    def stem(self, word):
+        try:
+            return self.table[word]
+        except KeyError:
+            pass
+        if len(self.table) >= self.max_size:
+            for old_word in list(self.table)[:max(1, len(self.table) // 2)]:
+                del self.table[old_word]
+        stem = self.table[word] = self.stemmer.stem(word)
+        return stem
+
+# One stemmer per language and process
+_stemmers = {}
+
+def get_stemmer(language='english', max_size=100000):
+    '''
+    The shared stemmer for 'language'. The size of the table is updated to 'max_size'.
+    '''
+    if language not in _stemmers:
+        _stemmers[language] = MemoStemmer(language, max_size)
+    _stemmers[language].max_size = max_size
+    return _stemmers[language]
@@ -0,0 +1,109 @@
+'''
+Classify new lyrics with a model trained on a project file.
+Lyrics are read from a folder (one file per song), a packed corpus file or a .jsonl file
+with one json object per line with 'lyrics' (and optionally 'name').
+The result is written as one json object per line with name, genre and log probability of each genre.
+
+All arguments after the input and output are passed to "classify.py", for example:
+    python tag-lyrics.py new-lyrics/ tags.jsonl billboard.json --backend sparse -u 2500
+
+The trained model can be saved with '--save_model' and used later with '--model', without training again:
+    python tag-lyrics.py new-lyrics/ tags.jsonl billboard.json --backend sparse -u 2500 --save_model billboard.model
+    python tag-lyrics.py more-lyrics/ tags.jsonl --model billboard.model
+'''
+
+import argparse
+import json
+import os
+from time import time
+from corpus import PackedCorpus
+from model import Model
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('input', type=str, help='Folder, packed corpus or .jsonl file with lyrics to classify')
+    parser.add_argument('output_file', type=str, help='Name of output file (.jsonl)')
+    parser.add_argument('--chunk_size', type=int, default=1000, help='Number of songs classified at the same time')
+    parser.add_argument('--model', type=str, default='', help='Use a saved model instead of training')
+    parser.add_argument('--save_model', type=str, default='', help='Save the trained model (sparse backend) to this file')
+
+    args, classify_arguments = parser.parse_known_args()
+    if args.model:
+        if classify_arguments:
+            parser.error('Arguments for training can not be used with --model: {}'.format(' '.join(classify_arguments)))
+        return args, None
+    # Training imports nltk, which is slow, only done when needed
+    from classify import parse_args as parse_classify_args
+    classify_args = parse_classify_args(classify_arguments)
+    if args.save_model and classify_args.backend != 'sparse':
+        parser.error('Only models trained with --backend sparse can be saved')
+    return args, classify_args
+
+def train_model(args, classify_args):
+    '''
+    Train on the project file, returns the trained 'Classy'
+    '''
+    from classify import get_lyrics_from_file, all_features
+    from bayes import Classy
+
+    if 'all' in classify_args.features:
+        classify_args.features = list(all_features.keys())[1:]
+    else:
+        classify_args.features = [list(all_features.keys())[1]] + classify_args.features
+
+    t_start = time()
+    print('Training on: "{}"'.format(classify_args.file))
+    genre_distribution, corpus, failed = get_lyrics_from_file(classify_args)
+    classy = Classy(corpus, classify_args)
+    classy.fit_all()
+    print()
+    print('Trained on {} songs in {:.1f} seconds'.format(len(corpus), time() - t_start))
+
+    if args.save_model:
+        Model.from_classy(classy).save(args.save_model)
+        print('Model saved to: "{}"'.format(args.save_model))
+    return classy
+
+def read_lyrics(input_name):
+    '''
+    Yields all songs in 'input_name' as dicts with 'name' and 'lyrics', one at a time
+    '''
+    if os.path.isdir(input_name):
+        for file_name in sorted(os.listdir(input_name)):
+            with open(os.path.join(input_name, file_name)) as f:
+                yield {'name': file_name, 'lyrics': f.read()}
+    elif input_name.endswith('.jsonl'):
+        with open(input_name) as f:
+            for idx, line in enumerate(f):
+                if line.strip():
+                    song = json.loads(line)
+                    song.setdefault('name', str(idx))
+                    yield song
+    else:
+        corpus = PackedCorpus(input_name)
+        for idx, (artist, song, genre, offset, length) in enumerate(corpus.entries):
+            lyrics = corpus.lyrics(idx)
+            if lyrics is not None:
+                yield {'name': artist + '~' + song, 'lyrics': lyrics}
+        corpus.close()
+
+if __name__ == '__main__':
+    args, classify_args = parse_args()
+
+    if args.model:
+        t_start = time()
+        classifier = Model.load(args.model)
+        print('Loaded model "{}" in {:.3f} seconds'.format(args.model, time() - t_start))
+    else:
+        classifier = train_model(args, classify_args)
+
+    t_start = time()
+    cntr = 0
+    with open(args.output_file, 'w') as f:
+        for song, genre, log_prob in classifier.classify_batch(read_lyrics(args.input), args.chunk_size):
+            f.write(json.dumps({'name': song['name'], 'genre': genre, 'log_prob': log_prob}) + '\n')
+            cntr += 1
+    print()
+    print('Classified {} songs in {:.1f} seconds'.format(cntr, time() - t_start))
+    print('Saved to: "{}"'.format(args.output_file))
@@ -174,6 +174,23 @@ tests = {
         ['--features', 'stopwords'],
         ['--features', 'tokenize', 'stopwords'],
     ],
+    'uni_sweep': [
+        'Unigram-threshold-sweep',
+        ['billboard.json', '--iterations', '5', '--backend', 'sparse', '--sweep', '1', '2', '5', '10', '20', '50', '100', '250', '500', '1000'],
+        [],
+        ['--features', 'meta'],
+        ['--features', 'stopwords'],
+    ],
+    'event_model': [
+        'Event-model-sparse',
+        ['billboard.json', '--iterations', '5', '--backend', 'sparse', '--uni_thresh'],
+        ['500'],
+        ['500', '--event_model', 'multinomial'],
+        ['2500'],
+        ['2500', '--event_model', 'multinomial'],
+        ['5000'],
+        ['5000', '--event_model', 'multinomial'],
+    ],
     'meta_g': [
         'meta_vs_baseline',
         ['billboard.json', '--iterations', '5'],
@@ -0,0 +1,56 @@
+'''
+Persistent cache of tokenized (and stemmed) lyrics.
+Tokenization only depends on the text and on the tokenize/stem settings, not on the
+train/test split, so the tokens are stored on disk and reused between iterations and runs.
+
+Each entry is a compressed file named by the hash of the text and the settings,
+see 'disk_cache.py'.
+'''
+
+from nltk import word_tokenize
+from disk_cache import DiskCache, cache_key
+import zlib
+
+def tokenize(text, tokenize=False, stemmer=None):
+    '''
+    Words of 'text'. Split on space or, if 'tokenize' is set, with 'word_tokenize'.
+    If 'stemmer' is given, all words are stemmed.
+    '''
+    if tokenize:
+        words = word_tokenize(text)
+    else:
+        words = [word.rstrip() for word in text.split(' ') if word.rstrip()]
+    if stemmer is not None:
+        words = [stemmer.stem(word) for word in words]
+    return words
+
+class TokenCache(DiskCache):
+    def __init__(self, folder, max_size=512 * 2**20):
+        '''
+        'folder': Where the tokens are stored
+        'max_size': Maximum size of the cache in bytes
+        '''
+        super().__init__(folder, max_size)
+        self.hits = 0
+        self.misses = 0
+
+    def tokens(self, text, tokenize_text=False, stemmer=None):
+        '''
+        Same as 'tokenize' but read from the cache if the text has been tokenized before.
+        '''
+        flags = 'tokenize={:d}|stem={:d}'.format(bool(tokenize_text), stemmer is not None)
+        key = cache_key(flags, text)
+
+        data = self.read(key)
+        if data is not None:
+            try:
+                data = zlib.decompress(data).decode('utf-8')
+                self.hits += 1
+                return data.split('\0') if data else []
+            except zlib.error:
+                pass
+
+        self.misses += 1
+        words = tokenize(text, tokenize_text, stemmer)
+        self.store(key, zlib.compress('\0'.join(words).encode('utf-8')))
+        return words
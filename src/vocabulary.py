@@ -0,0 +1,153 @@
+'''
+Corpus-wide integer ids of the words and n-grams, used for the preprocessed corpus ('--preprocess').
+When the corpus is preprocessed, each different word and n-gram is stored once in the vocabulary
+and the songs only keep compact arrays with the ids and counts of their n-grams. Counting and
+the lookup of the feature columns are then done on the ids, see 'NgramCounter' and 'Classy.id_row'.
+
+Each word of a song is interned once ('intern_lines'). An n-gram is the id of the n-gram of one
+order less followed by the id of its last word, so the n-grams are extracted from the ids of the
+words, as arrays, without making the joined strings. The string of an n-gram ('gram') is only made
+for the selected n-grams. With '--hash_bits' the n-grams are buckets which are interned as they are.
+Without '--preprocess' each song is tokenized when it is used and no ids are made.
+'''
+
+from array import array
+import numpy as np
+
+class Vocabulary:
+    def __init__(self, max_order=5, hashed=False):
+        '''
+        'hashed': The n-grams of order 2 and up are buckets from 'features.hash_ngrams'
+        '''
+        # One table per order, n-gram -> id and id -> n-gram. The words are the first table,
+        # the n-grams of the other orders are 'key' of the n-gram of one order less and the last word.
+        self.ids = [{} for _ in range(max_order)]
+        self.grams = [[] for _ in range(max_order)]
+        self.hashed = hashed
+
+    def size(self, order):
+        return len(self.grams[order-1])
+
+    @staticmethod
+    def key(prefix, word):
+        return (prefix << 32) | word
+
+    def gram(self, order, idx):
+        '''
+        The n-gram of 'order' with id 'idx', words joined by '|' as in 'song_grams'
+        '''
+        if order == 1 or self.hashed:
+            return self.grams[order-1][idx]
+        words = []
+        for table in reversed(self.grams[1:order]):
+            key = table[idx]
+            words.append(self.grams[0][key & 0xFFFFFFFF])
+            idx = key >> 32
+        words.append(self.grams[0][idx])
+        return '|'.join(reversed(words))
+
+    def lookup(self, order, gram):
+        '''
+        Id of the n-gram 'gram' (as returned by 'gram'), None if not in the vocabulary.
+        Words which contain '|' can not be told apart from two words, their n-grams are not found.
+        '''
+        if order == 1 or self.hashed:
+            return self.ids[order-1].get(gram)
+        words = gram.split('|')
+        if len(words) != order:
+            return None
+        idx = self.ids[0].get(words[0])
+        for ids, word in zip(self.ids[1:], words[1:]):
+            word = self.ids[0].get(word)
+            if idx is None or word is None:
+                return None
+            idx = ids.get(self.key(idx, word))
+        return idx
+
+    def intern(self, order, counter):
+        '''
+        Ids and counts of the n-grams of 'order' in 'counter' as two arrays,
+        in the same order as the counter. New n-grams get the next id.
+        '''
+        ids = self.ids[order-1]
+        grams = self.grams[order-1]
+        song_ids = array('I')
+        counts = array('I')
+        for gram, cnt in counter.items():
+            idx = ids.get(gram)
+            if idx is None:
+                idx = ids[gram] = len(grams)
+                grams.append(gram)
+            song_ids.append(idx)
+            counts.append(cnt)
+        return song_ids, counts
+
+    def intern_keys(self, order, keys):
+        '''
+        Ids of the n-grams 'keys' (array of 'key'), new n-grams get the next id
+        '''
+        ids = self.ids[order-1]
+        grams = self.grams[order-1]
+        values, inverse = np.unique(keys, return_inverse=True)
+        result = np.empty(len(values), dtype=np.uint64)
+        for pos, key in enumerate(values.tolist()):
+            idx = ids.get(key)
+            if idx is None:
+                idx = ids[key] = len(grams)
+                grams.append(key)
+            result[pos] = idx
+        return result[inverse.reshape(-1)]
+
+    def intern_lines(self, lines, max_order=5):
+        '''
+        Ids and counts of the n-grams of order 2 to 'max_order' in 'lines' (the words of each line,
+        as from 'song_lines'), same n-grams and order as the Counters of 'song_grams'.
+        Returns a list with two arrays per order, as 'intern'.
+        '''
+        words = [word for line in lines for word in line]
+        if not words:
+            return [(array('I'), array('I')) for _ in range(2, max_order + 1)]
+        word_ids = self.ids[0]
+        word_grams = self.grams[0]
+        ids = np.empty(len(words), dtype=np.uint64)
+        for pos, word in enumerate(words):
+            idx = word_ids.get(word)
+            if idx is None:
+                idx = word_ids[word] = len(word_grams)
+                word_grams.append(word)
+            ids[pos] = idx
+        position = np.concatenate([np.arange(len(line)) for line in lines])
+        non_empty = np.fromiter((len(word.rstrip()) > 0 for word in words), dtype=bool, count=len(words))
+
+        result = []
+        # 'prefix[j]' is the id of the n-gram of the previous order which ends at word j
+        prefix = ids
+        for order in range(2, max_order + 1):
+            # The n-gram ends at word 'end', which must be in the same line. The n-grams which end
+            # with an empty word are not counted, but are interned as part of the longer n-grams.
+            end = np.nonzero(position >= order - 1)[0]
+            grams = np.zeros(len(words), dtype=np.uint64)
+            grams[end] = self.intern_keys(order, (prefix[end - 1] << np.uint64(32)) | ids[end])
+            counted = grams[end[non_empty[end]]]
+            values, first, counts = np.unique(counted, return_index=True, return_counts=True)
+            first_order = np.argsort(first)
+            result.append((array('I', values[first_order].astype(np.uint32).tobytes()), array('I', counts[first_order].astype(np.uint32).tobytes())))
+            prefix = grams
+        return result
+
+    def intern_all(self, counters, previous=None):
+        '''
+        'intern' for a list of counters, one per order starting at 1.
+        Arrays equal to the same order in 'previous' are shared with it.
+        '''
+        return self.share([self.intern(order, counter) for order, counter in enumerate(counters, 1)], previous)
+
+    @staticmethod
+    def share(result, previous):
+        '''
+        Arrays in 'result' (list of ids and counts per order) equal to the same order in 'previous'
+        are replaced by the arrays of 'previous', the songs only keep one copy
+        '''
+        if previous is None:
+            return result
+        return [previous[order] if order < len(previous) and previous[order] == arrays else arrays for order, arrays in enumerate(result)]